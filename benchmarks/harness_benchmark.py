@@ -0,0 +1,269 @@
+# End-to-end benchmark of the autograder harness itself
+# Grades synthetic submissions (that exit right away, print 100 MB, run until just before the test timeout, come with
+# hundreds of source files, or crash on start) with every sample autograder, traced with `tracing.py`, and splits the
+# wall time of every run into compile time, student program time and harness overhead (by phase)
+# Overhead (in total and per phase) is compared with the baselines stored in `harness_baselines.json`; the benchmark
+# exits with status 1 if any autograder/scenario pair (or any phase of one) got slower than its baseline allows
+#
+# Usage (from the repository root):
+#   python3 benchmarks/harness_benchmark.py [--autograders A B] [--scenarios S T] [--update-baselines]
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from shutil import copytree, rmtree
+
+repositoryDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repositoryDir)
+# regrade.py
+import regrade
+
+# Sample autograders that are benchmarked by default
+autograders = ['error_test_examples', 'file_existence_tests', 'input_output_comparison', 'ppm_simple_comparison']
+
+# Seconds the near-timeout submission runs for (the sample tests time out after 10 seconds)
+nearTimeoutSeconds = 9
+
+# Number of extra source files in the many-sources submission
+manySourceFiles = 300
+
+# Seconds the `test_checkFiles` test of every sample autograder sleeps for. The sleep is part of the sample tests,
+# not of the harness, so it is left out of the overhead
+testSleepSeconds = 1
+
+# Rules added to the autograder's makefile for the many-sources submission, so its extra sources are compiled (into a
+# library) along with the autograder's own default goal
+manySourcesMakefile = '''benchmark: all libunits.a
+
+%s
+
+UNITS = $(wildcard unit*.c)
+
+libunits.a: $(UNITS:.c=.o)
+\tar rcs $@ $^
+
+unit%%.o: unit%%.c
+\tgcc -Wall -c $< -o $@
+'''
+
+# Stored overhead baselines (seconds, per autograder and scenario)
+baselinesFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'harness_baselines.json')
+
+# A run regresses if its overhead is above baseline * (1 + tolerance) + slack, or if any of its phases takes longer
+# than that phase's baseline * (1 + tolerance) + phase slack (phases without a baseline have a baseline of 0)
+defaultTolerance = 0.25
+defaultSlack = 0.15
+defaultPhaseSlack = 0.1
+
+# Body of every required `.c` file for each scenario
+scenarios = {
+    'instant_exit': '''int main(void) {
+    return 0;
+}
+''',
+    'large_output': '''#include <stdio.h>
+#include <string.h>
+
+int main(void) {
+    static char buffer[1 << 16];
+    memset(buffer, 'x', sizeof(buffer) - 1);
+    buffer[sizeof(buffer) - 1] = '\\n';
+    for (int i = 0; i < 1600; i++) {
+        fwrite(buffer, 1, sizeof(buffer), stdout);
+    }
+    return 0;
+}
+''',
+    'near_timeout': '''#include <unistd.h>
+
+int main(void) {
+    sleep(%d);
+    return 0;
+}
+''' % nearTimeoutSeconds,
+    'many_sources': '''int main(void) {
+    return 0;
+}
+''',
+    'crash_on_start': '''int main(void) {
+    volatile int *pointer = 0;
+    return *pointer;
+}
+''',
+}
+
+# Writes a synthetic submission: every `.c` file the autograder's sample submission has, with the scenario's body
+# The many-sources submission also comes with a makefile (the autograder's, plus rules that compile its extra sources)
+def writeSubmission(autograder, scenario, submissionDir):
+    os.makedirs(submissionDir)
+    for name in os.listdir(os.path.join(repositoryDir, autograder, 'submission')):
+        if name.endswith('.c'):
+            with open(os.path.join(submissionDir, name), 'w') as file:
+                file.write(scenarios[scenario])
+    if scenario == 'many_sources':
+        for index in range(manySourceFiles):
+            with open(os.path.join(submissionDir, 'unit%d.c' % index), 'w') as file:
+                file.write('int unit%d(int value) {\n    return value + %d;\n}\n' % (index, index))
+        with open(os.path.join(repositoryDir, autograder, 'source', 'makefile')) as file:
+            makefile = file.read()
+        with open(os.path.join(submissionDir, 'makefile'), 'w') as file:
+            file.write(manySourcesMakefile % makefile)
+
+# Adds up the time covered by a list of (start, end) intervals, counting overlapping time once
+def coveredTime(intervals):
+    total = 0.0
+    coveredUntil = None
+    for start, end in sorted(intervals):
+        if coveredUntil is not None and start < coveredUntil:
+            start = coveredUntil
+        if end > start:
+            total += end - start
+            coveredUntil = end
+    return total
+
+# Works out how long each span ran for itself (without the spans nested inside it), per process and thread
+# Student programs that run at the same time (like the runs of an execution plan, each on a lane of its own) count
+# once towards student time, and not towards the span that waited for them
+# Returns (phase times, student program time, compile time), where phase times maps a phase name to seconds
+def splitTrace(events):
+    phases = {}
+    compile = 0.0
+    studentRuns = []
+    threads = {}
+    for event in sorted(events, key=lambda event: (event['pid'], event['tid'], event['ts'], -event['dur'])):
+        event['start'], event['end'], event['children'] = event['ts'] / 1e6, (event['ts'] + event['dur']) / 1e6, []
+        threads.setdefault((event['pid'], event['tid']), []).append(event)
+
+    for threadEvents in threads.values():
+        stack = []
+        for event in threadEvents:
+            while stack and stack[-1]['end'] <= event['start']:
+                stack.pop()
+            event['compile'] = event['name'] == 'compileProgram' or any(parent['name'] == 'compileProgram' for parent in stack)
+            if stack:
+                stack[-1]['children'].append(event)
+            stack.append(event)
+            if event['name'] == 'run process' and not event['compile']:
+                studentRuns.append(event)
+
+    for threadEvents in threads.values():
+        for event in threadEvents:
+            seconds = event['end'] - event['start'] - sum(child['end'] - child['start'] for child in event['children'])
+            if event['compile']:
+                compile += seconds
+            elif event['name'] != 'run process':
+                # Time the span spent itself (between its children), minus student programs that ran on other lanes
+                gaps = []
+                gapStart = event['start']
+                for child in event['children'] + [{'start': event['end'], 'end': event['end']}]:
+                    gaps.append((gapStart, child['start']))
+                    gapStart = max(gapStart, child['end'])
+                for gapStart, gapEnd in gaps:
+                    seconds -= coveredTime([(max(run['start'], gapStart), min(run['end'], gapEnd)) for run in studentRuns
+                                            if run['pid'] == event['pid'] and run['tid'] != event['tid']])
+                name = 'test code (untraced)' if event['cat'] == 'test' else 'runner' if event['cat'] == 'runner' else event['name']
+                phases[name] = phases.get(name, 0.0) + max(seconds, 0.0)
+    return phases, coveredTime([(run['start'], run['end']) for run in studentRuns]), compile
+
+# Grades one synthetic submission with one autograder and returns its measurements
+def runScenario(autograder, scenario):
+    workspace = tempfile.mkdtemp(prefix='harness-benchmark-')
+    autograderDir = os.path.join(workspace, 'autograder')
+    try:
+        copytree(os.path.join(repositoryDir, autograder, 'source'), os.path.join(autograderDir, 'source'), ignore=regrade.ignoredSourceFiles)
+        writeSubmission(autograder, scenario, os.path.join(autograderDir, 'submission'))
+        os.makedirs(os.path.join(autograderDir, 'results'))
+        trace = os.path.join(autograderDir, 'results', 'trace.json')
+
+        env = dict(os.environ, AUTOGRADER_DIR=autograderDir, AUTOGRADER_TRACE=trace,
+                   AUTOGRADER_COMPILE_CACHE=os.path.join(workspace, 'compile_cache'))
+        start = time.monotonic()
+        subprocess.run(['bash', 'run_autograder'], cwd=os.path.join(autograderDir, 'source'), env=env,
+                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wall = time.monotonic() - start
+        regrade.killWorkspaceProcesses(workspace)
+
+        with open(trace) as file:
+            phases, student, compile = splitTrace(json.load(file)['traceEvents'])
+        with open(os.path.join(autograderDir, 'results', 'results.json')) as file:
+            score, maxScore = regrade.totalScore(json.load(file))
+    finally:
+        rmtree(workspace, ignore_errors=True)
+
+    # Anything not spent compiling or running the student's program (including starting Python), or sleeping in the
+    # sample tests, is harness overhead
+    phases['test code (untraced)'] = max(phases.get('test code (untraced)', 0.0) - testSleepSeconds, 0.0)
+    overhead = wall - student - compile - testSleepSeconds
+    phases['run_autograder and Python startup'] = max(overhead - sum(phases.values()), 0.0)
+    return {'wall': wall, 'compile': compile, 'student': student, 'overhead': overhead,
+            'phases': phases, 'score': score, 'max_score': maxScore}
+
+# Lists how a measurement regressed past its baseline (a {'overhead': seconds, 'phases': {name: seconds}} entry)
+def findRegressions(result, baseline, tolerance, slack, phaseSlack):
+    regressions = []
+    if result['overhead'] > baseline['overhead'] * (1 + tolerance) + slack:
+        regressions.append('overhead %.3fs, baseline %.3fs' % (result['overhead'], baseline['overhead']))
+    for name, seconds in sorted(result['phases'].items()):
+        phaseBaseline = baseline['phases'].get(name, 0.0)
+        if seconds > phaseBaseline * (1 + tolerance) + phaseSlack:
+            regressions.append('%s %.3fs, baseline %.3fs' % (name, seconds, phaseBaseline))
+    return regressions
+
+# Formats one measurement as a table row, with its three most expensive overhead phases
+def formatRow(autograder, scenario, result, baseline):
+    slowest = sorted(result['phases'].items(), key=lambda phase: phase[1], reverse=True)[:3]
+    return '%-24s %-15s %8.2f %8.2f %8.2f %9.3f %9s  %s' % (
+        autograder, scenario, result['wall'], result['compile'], result['student'], result['overhead'],
+        '-' if baseline is None else '%.3f' % baseline['overhead'], ', '.join('%s %.3f' % phase for phase in slowest))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the overhead of the autograder harness on synthetic submissions')
+    parser.add_argument('--autograders', nargs='+', default=autograders, choices=autograders, help='autograders to benchmark (default: all)')
+    parser.add_argument('--scenarios', nargs='+', default=list(scenarios), choices=list(scenarios), help='submissions to grade (default: all)')
+    parser.add_argument('--tolerance', type=float, default=defaultTolerance, help='allowed relative overhead increase over the baseline (default: %(default)s)')
+    parser.add_argument('--slack', type=float, default=defaultSlack, help='allowed absolute overhead increase in seconds (default: %(default)s)')
+    parser.add_argument('--phase-slack', type=float, default=defaultPhaseSlack, help='allowed absolute increase of each phase in seconds (default: %(default)s)')
+    parser.add_argument('--update-baselines', action='store_true', help='store the measured overhead as the new baselines')
+    parser.add_argument('--output', help='also write every measurement (with per-phase overhead) to this JSON file')
+    args = parser.parse_args()
+
+    try:
+        with open(baselinesFile) as file:
+            baselines = json.load(file)
+    except FileNotFoundError:
+        baselines = {}
+
+    print('%-24s %-15s %8s %8s %8s %9s %9s  %s' % ('autograder', 'scenario', 'wall', 'compile', 'student', 'overhead', 'baseline', 'slowest overhead phases (s)'))
+    results = {}
+    regressions = []
+    for autograder in args.autograders:
+        for scenario in args.scenarios:
+            result = runScenario(autograder, scenario)
+            results.setdefault(autograder, {})[scenario] = result
+            baseline = baselines.get(autograder, {}).get(scenario)
+            print(formatRow(autograder, scenario, result, baseline), flush=True)
+            if baseline is not None:
+                regressions += ['%s/%s: %s' % (autograder, scenario, regression)
+                                for regression in findRegressions(result, baseline, args.tolerance, args.slack, args.phase_slack)]
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.update_baselines:
+        for autograder, measured in results.items():
+            for scenario, result in measured.items():
+                baselines.setdefault(autograder, {})[scenario] = {
+                    'overhead': round(result['overhead'], 3),
+                    'phases': {name: round(seconds, 3) for name, seconds in result['phases'].items()},
+                }
+        with open(baselinesFile, 'w') as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+            file.write('\n')
+        print('Updated %s' % os.path.relpath(baselinesFile))
+    elif regressions:
+        print('\nHarness overhead regressed past the stored baselines:\n  ' + '\n  '.join(regressions), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,52 @@
+# Micro-benchmark for the output normalizer in `source/tests/utils.py`
+# Compares the original line-by-line `removeEmptyLines` with the compiled Normalizer on ~1 MB outputs
+#
+# Usage (from the repository root):
+#   python3 benchmarks/normalizer_benchmark.py [autograder_dir]
+import os
+import re
+import sys
+import timeit
+
+autograderDir = sys.argv[1] if len(sys.argv) > 1 else 'input_output_comparison'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', autograderDir, 'source', 'tests'))
+# utils.py
+import utils
+
+# Original implementation of removeEmptyLines, kept here as the baseline
+def legacyRemoveEmptyLines(text):
+    lst = filter(lambda s: len(s.strip()) != 0, list(map(lambda s: re.sub(' +', ' ', s.strip()), text.split("\n"))))
+    return "\n".join(list(lst)) + "\n"
+
+# Builds roughly `size` bytes of program-like output: PPM pixel rows with extra spaces, trailing whitespace,
+# blank lines and CRLF line endings mixed in
+def makeOutput(size):
+    lines = []
+    total = 0
+    row = 0
+    while total < size:
+        line = '  '.join('%d %d  %d' % ((row * 7) % 256, (row * 13) % 256, (row * 31) % 256) for _ in range(5))
+        line += ['', '   ', '\r', ' \t'][row % 4]
+        lines.append(line)
+        if row % 9 == 0:
+            lines.append('    ')
+        total += len(line) + 1
+        row += 1
+    return '\n'.join(lines) + '\n'
+
+def bench(name, function, argument, repeat=5):
+    best = min(timeit.repeat(lambda: function(argument), number=1, repeat=repeat))
+    print('{:<40} {:>10.2f} ms'.format(name, best * 1000))
+    return best
+
+if __name__ == '__main__':
+    text = makeOutput(1024 * 1024)
+    data = text.encode('utf-8')
+    assert legacyRemoveEmptyLines(text) == utils.removeEmptyLines(text)
+    assert legacyRemoveEmptyLines(text).encode('utf-8') == utils.defaultNormalizer(data)
+
+    print('Normalizing {:.2f} MB of output ({} lines)'.format(len(data) / 1024 / 1024, text.count('\n')))
+    baseline = bench('removeEmptyLines (original, str)', legacyRemoveEmptyLines, text)
+    strTime = bench('removeEmptyLines (Normalizer, str)', utils.removeEmptyLines, text)
+    bytesTime = bench('Normalizer (bytes)', utils.defaultNormalizer, data)
+    print('Speedup: {:.1f}x (str), {:.1f}x (bytes)'.format(baseline / strTime, baseline / bytesTime))
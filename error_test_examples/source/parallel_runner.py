@@ -0,0 +1,152 @@
+import os
+import sys
+import time
+import multiprocessing
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+# Requires gradescope_utils
+from gradescope_utils.autograder_utils.json_test_runner import JSONTestResult, JSONTestRunner
+
+# Runner and chunks of tests shared with forked worker processes
+# Workers are forked after these are set, so nothing has to be pickled on the way in
+_sharedRunner = None
+_sharedChunks = []
+
+# Gets the number of cores this process may use: the cores it may run on (its CPU affinity), capped by the CPU
+# quota of its cgroup (like the limits Gradescope containers run under), if it has one
+def availableCores():
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as file:
+            quota, period = file.read().split()
+        if quota != 'max':
+            cores = min(cores, max(1, -(-int(quota) // int(period))))
+    except (OSError, ValueError):
+        pass
+    return cores
+
+# Flattens a (possibly nested) unittest suite into a list of individual test cases
+def flattenSuite(suite):
+    if isinstance(suite, unittest.TestSuite):
+        return [test for child in suite for test in flattenSuite(child)]
+    return [suite]
+
+# Gets the test method behind a test case, if the case has one
+def getTestMethod(test):
+    return getattr(test, getattr(test, '_testMethodName', ''), None)
+
+# Determines whether a test was marked with the `@parallel` decorator from utils.py
+def isParallel(test):
+    return getattr(getTestMethod(test), '__parallel__', False)
+
+# Sort key that orders `@number` values the way Gradescope does ("2" < "10", "1.2" < "1.10")
+# Tests without a number are sorted after every numbered test
+def numberKey(number):
+    if number is None:
+        return (1, ())
+    return (0, tuple((0, int(part), '') if part.isdigit() else (1, 0, part) for part in str(number).split('.')))
+
+# Runs a chunk of tests inside a forked worker with its own result object (and its own stdout buffer)
+# The chunk runs as a unittest.TestSuite, so the worker runs the class and module fixtures (setUpClass,
+# setUpModule, tearDownClass, ...) of its tests, like the serial runner does
+# Returns the JSON entries produced by the tests, and the number of tests run
+def _runIsolated(index):
+    runner = _sharedRunner
+    result = runner.resultclass(runner.stream, runner.descriptions, runner.verbosity, [], [], runner.failure_prefix)
+    result.failfast = runner.failfast
+    result.buffer = runner.buffer
+    result.startTestRun()
+    try:
+        unittest.TestSuite(_sharedChunks[index])(result)
+    finally:
+        result.stopTestRun()
+    return result.results, result.leaderboard, result.testsRun
+
+# Gets the list of program runs recorded by utils.py for the current test (see `programRuns` in utils.py)
+# utils.py is imported by the tests (from the `tests` folder), so it is looked up instead of imported here
+def recordedProgramRuns():
+    return getattr(sys.modules.get('utils'), 'programRuns', None)
+
+# Gets tracing.py, if the tests use it (it is imported from the `tests` folder, like utils.py)
+def tracingModule():
+    return sys.modules.get('tracing')
+
+# JSONTestResult that adds how long each test took (`execution_time`, in seconds) to its entry in results.json,
+# along with the wall time, CPU time and peak memory of every program the test ran (`extra_data`)
+class ResourceJSONTestResult(JSONTestResult):
+    def startTest(self, test):
+        super(ResourceJSONTestResult, self).startTest(test)
+        self.testStart = time.monotonic()
+        self.testStartNs = time.monotonic_ns()
+        runs = recordedProgramRuns()
+        if runs is not None:
+            runs.clear()
+        tracing = tracingModule()
+        if tracing is not None and tracing.enabled:
+            tracing.currentTest = self.getDescription(test)
+
+    def buildResult(self, test, err=None):
+        result = super(ResourceJSONTestResult, self).buildResult(test, err)
+        result['execution_time'] = round(time.monotonic() - self.testStart, 3)
+        runs = recordedProgramRuns()
+        if runs:
+            result['extra_data'] = {'program_runs': list(runs)}
+        tracing = tracingModule()
+        if tracing is not None and tracing.enabled:
+            tracing.record(self.getDescription(test), 'test', self.testStartNs, time.monotonic_ns(), {'number': self.getNumber(test)})
+            tracing.currentTest = None
+            tracing.flush()
+        return result
+
+# JSONTestRunner that records the resources used by each test (see ResourceJSONTestResult)
+class ResourceJSONTestRunner(JSONTestRunner):
+    resultclass = ResourceJSONTestResult
+
+# Callable that stands in for the suite handed to JSONTestRunner.run
+# Tests not marked `@parallel` (file checks, compilation) run first, one at a time, in `@number` order
+# The `@parallel` tests are then split into one chunk per worker (in `@number` order, round robin), and the chunks
+# run concurrently on a pool of worker processes
+# Both parts run as unittest.TestSuites, so class and module fixtures run around them (in the runner process for the
+# serial tests, and in each worker for its chunk)
+class _ParallelSuite(object):
+    def __init__(self, runner, suite):
+        self.runner = runner
+        self.tests = flattenSuite(suite)
+
+    def __call__(self, result):
+        global _sharedRunner, _sharedChunks
+
+        key = lambda test: numberKey(getattr(getTestMethod(test), '__number__', None))
+        serialTests = sorted([test for test in self.tests if not isParallel(test)], key=key)
+        parallelTests = sorted([test for test in self.tests if isParallel(test)], key=key)
+
+        if serialTests:
+            unittest.TestSuite(serialTests)(result)
+
+        if parallelTests and not result.shouldStop:
+            workers = min(self.runner.jobs, len(parallelTests))
+            _sharedRunner, _sharedChunks = self.runner, [parallelTests[index::workers] for index in range(workers)]
+            try:
+                with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+                    for tests, leaderboard, testsRun in pool.map(_runIsolated, range(workers)):
+                        result.results.extend(tests)
+                        result.leaderboard.extend(leaderboard)
+                        result.testsRun += testsRun
+            finally:
+                _sharedRunner, _sharedChunks = None, []
+
+        # Keep results.json in the same order as the `@number` decorator values
+        result.results.sort(key=lambda entry: numberKey(entry.get('number')))
+
+# JSONTestRunner that runs independent tests concurrently on a configurable worker pool
+# Produces the same results.json (weights, visibility, numbers, resource usage) as ResourceJSONTestRunner
+class ParallelJSONTestRunner(ResourceJSONTestRunner):
+    def __init__(self, jobs=None, **kwargs):
+        super(ParallelJSONTestRunner, self).__init__(**kwargs)
+        self.jobs = max(1, jobs or availableCores())
+
+    def run(self, test):
+        return super(ParallelJSONTestRunner, self).run(_ParallelSuite(self, test))
@@ -3,9 +3,7 @@ import unittest
 import timeout
 # Requires gradescope_utils
 from gradescope_utils.autograder_utils.decorators import number, weight, visibility
-import subprocess
 from time import sleep
-from re import sub
 # utils.py
 from utils import *
 
@@ -50,9 +48,10 @@ class TestDiff(unittest.TestCase):
 
         checkSourceFiles(self, self.files)
 
-        # Create a subprocess to run the student's Makefile to ensure it compiles
-        test = subprocess.Popen(["make"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
+        # Run the student's Makefile to ensure it compiles (in its own session, so make and everything it started
+        # are stopped with it), or restore the executables and compiler output of an identical earlier compile
+        test = compileProgram(self.executables)
+        stdout, stderr = test.stdout, test.stderr
         
         # Try to decode stderr
         try:
@@ -71,8 +70,10 @@ class TestDiff(unittest.TestCase):
     @number("3")
     # Test visibility
     @visibility("visible")
+    # Allow this test to run concurrently with other output tests
+    @parallel()
     # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
+    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False, use_watchdog=True)
     # Associated point value within Gradescope
     @weight(11.25)
     def test_UnicodeDecodeError(self):
@@ -81,9 +82,9 @@ class TestDiff(unittest.TestCase):
         
         checkExecutables(self, self.executables)
 
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["./unicodeDecodeError.out input.c"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
+        # Run the student's code to obtain an output (reusing the result of an identical earlier run)
+        test = runProgram(['./unicodeDecodeError.out', 'input.c'], executables=self.executables)
+        stdout, stderr = test.stdout, test.stderr
         
         try:
             checkRuntimeErrors(test, self, stdout, stderr)
@@ -104,7 +105,7 @@ class TestDiff(unittest.TestCase):
                 kill_fail(test, self, uninitializedCharacterMessage)
         
         # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
+        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError, RuntimeOutputTooLarge):
             pass
         
         test.terminate()
@@ -113,8 +114,10 @@ class TestDiff(unittest.TestCase):
     @number("4")
     # Test visibility
     @visibility("visible")
+    # Allow this test to run concurrently with other output tests
+    @parallel()
     # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
+    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False, use_watchdog=True)
     # Associated point value within Gradescope
     @weight(11.25)
     def test_Timeout(self):
@@ -123,9 +126,9 @@ class TestDiff(unittest.TestCase):
         
         checkExecutables(self, self.executables)
 
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["./loop.out"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
+        # Run the student's code to obtain an output (reusing the result of an identical earlier run)
+        test = runProgram(['./loop.out'], executables=self.executables)
+        stdout, stderr = test.stdout, test.stderr
         
         try:
             checkRuntimeErrors(test, self, stdout, stderr)
@@ -146,7 +149,7 @@ class TestDiff(unittest.TestCase):
                 kill_fail(test, self, uninitializedCharacterMessage)
         
         # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
+        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError, RuntimeOutputTooLarge):
             pass
         
         test.terminate()
@@ -155,8 +158,10 @@ class TestDiff(unittest.TestCase):
     @number("5")
     # Test visibility
     @visibility("visible")
+    # Allow this test to run concurrently with other output tests
+    @parallel()
     # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
+    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False, use_watchdog=True)
     # Associated point value within Gradescope
     @weight(11.25)
     def test_SIGABRT(self):
@@ -165,9 +170,9 @@ class TestDiff(unittest.TestCase):
         
         checkExecutables(self, self.executables)
 
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["./SIGABRT.out"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
+        # Run the student's code to obtain an output (reusing the result of an identical earlier run)
+        test = runProgram(['./SIGABRT.out'], executables=self.executables)
+        stdout, stderr = test.stdout, test.stderr
         
         try:
             checkRuntimeErrors(test, self, stdout, stderr)
@@ -188,7 +193,7 @@ class TestDiff(unittest.TestCase):
                 kill_fail(test, self, uninitializedCharacterMessage)
         
         # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
+        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError, RuntimeOutputTooLarge):
             pass
         
         test.terminate()
@@ -197,8 +202,10 @@ class TestDiff(unittest.TestCase):
     @number("6")
     # Test visibility
     @visibility("visible")
+    # Allow this test to run concurrently with other output tests
+    @parallel()
     # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
+    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False, use_watchdog=True)
     # Associated point value within Gradescope
     @weight(11.25)
     def test_SIGBUS(self):
@@ -207,9 +214,9 @@ class TestDiff(unittest.TestCase):
         
         checkExecutables(self, self.executables)
 
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["./SIGBUS.out"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
+        # Run the student's code to obtain an output (reusing the result of an identical earlier run)
+        test = runProgram(['./SIGBUS.out'], executables=self.executables)
+        stdout, stderr = test.stdout, test.stderr
         
         try:
             checkRuntimeErrors(test, self, stdout, stderr)
@@ -230,7 +237,7 @@ class TestDiff(unittest.TestCase):
                 kill_fail(test, self, uninitializedCharacterMessage)
         
         # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
+        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError, RuntimeOutputTooLarge):
             pass
         
         test.terminate()
@@ -239,8 +246,10 @@ class TestDiff(unittest.TestCase):
     @number("7")
     # Test visibility
     @visibility("visible")
+    # Allow this test to run concurrently with other output tests
+    @parallel()
     # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
+    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False, use_watchdog=True)
     # Associated point value within Gradescope
     @weight(11.25)
     def test_SIGFPE(self):
@@ -249,9 +258,9 @@ class TestDiff(unittest.TestCase):
         
         checkExecutables(self, self.executables)
 
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["./SIGFPE.out"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
+        # Run the student's code to obtain an output (reusing the result of an identical earlier run)
+        test = runProgram(['./SIGFPE.out'], executables=self.executables)
+        stdout, stderr = test.stdout, test.stderr
         
         try:
             checkRuntimeErrors(test, self, stdout, stderr)
@@ -272,7 +281,7 @@ class TestDiff(unittest.TestCase):
                 kill_fail(test, self, uninitializedCharacterMessage)
         
         # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
+        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError, RuntimeOutputTooLarge):
             pass
         
         test.terminate()
@@ -281,8 +290,10 @@ class TestDiff(unittest.TestCase):
     @number("8")
     # Test visibility
     @visibility("visible")
+    # Allow this test to run concurrently with other output tests
+    @parallel()
     # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
+    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False, use_watchdog=True)
     # Associated point value within Gradescope
     @weight(11.25)
     def test_SIGILL(self):
@@ -291,9 +302,9 @@ class TestDiff(unittest.TestCase):
         
         checkExecutables(self, self.executables)
 
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["./SIGILL.out"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
+        # Run the student's code to obtain an output (reusing the result of an identical earlier run)
+        test = runProgram(['./SIGILL.out'], executables=self.executables)
+        stdout, stderr = test.stdout, test.stderr
         
         try:
             checkRuntimeErrors(test, self, stdout, stderr)
@@ -314,7 +325,7 @@ class TestDiff(unittest.TestCase):
                 kill_fail(test, self, uninitializedCharacterMessage)
         
         # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
+        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError, RuntimeOutputTooLarge):
             pass
         
         test.terminate()
@@ -323,8 +334,10 @@ class TestDiff(unittest.TestCase):
     @number("9")
     # Test visibility
     @visibility("visible")
+    # Allow this test to run concurrently with other output tests
+    @parallel()
     # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
+    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False, use_watchdog=True)
     # Associated point value within Gradescope
     @weight(11.25)
     def test_SIGSEGV(self):
@@ -333,9 +346,9 @@ class TestDiff(unittest.TestCase):
         
         checkExecutables(self, self.executables)
 
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["./SIGSEGV.out"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
+        # Run the student's code to obtain an output (reusing the result of an identical earlier run)
+        test = runProgram(['./SIGSEGV.out'], executables=self.executables)
+        stdout, stderr = test.stdout, test.stderr
         
         try:
             checkRuntimeErrors(test, self, stdout, stderr)
@@ -356,7 +369,7 @@ class TestDiff(unittest.TestCase):
                 kill_fail(test, self, uninitializedCharacterMessage)
         
         # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
+        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError, RuntimeOutputTooLarge):
             pass
         
         test.terminate()
@@ -365,8 +378,10 @@ class TestDiff(unittest.TestCase):
     @number("10")
     # Test visibility
     @visibility("visible")
+    # Allow this test to run concurrently with other output tests
+    @parallel()
     # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
+    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False, use_watchdog=True)
     # Associated point value within Gradescope
     @weight(11.25)
     def test_SIGSEGV(self):
@@ -375,9 +390,9 @@ class TestDiff(unittest.TestCase):
         
         checkExecutables(self, self.executables)
 
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["make -s run"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
+        # Run the student's code to obtain an output (reusing the result of an identical earlier run)
+        test = runProgram(['make', '-s', 'run'], executables=self.executables)
+        stdout, stderr = test.stdout, test.stderr
         
         try:
             checkRuntimeErrors(test, self, stdout, stderr)
@@ -398,7 +413,7 @@ class TestDiff(unittest.TestCase):
                 kill_fail(test, self, uninitializedCharacterMessage)
         
         # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
+        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError, RuntimeOutputTooLarge):
             pass
         
         test.terminate()
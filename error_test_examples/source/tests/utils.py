@@ -1,13 +1,40 @@
 import os
-from shutil import copyfile
-from time import sleep
+import sys
+from shutil import copy, rmtree, which
 import subprocess
 import signal
 import re
 import textwrap
 import difflib
+import hashlib
+import pickle
+import fcntl
+import resource
+import time
+import selectors
+import asyncio
+import stat
+import fnmatch
+import threading
+import multiprocessing
+import shlex
+from functools import lru_cache
+from copy import copy as shallowCopy
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from array import array
 from pathlib import Path
-import os
+# timeout.py
+import timeout
+# tracing.py
+import tracing
+# Requires gradescope_utils
+from gradescope_utils.autograder_utils import decorators
+# NumPy is optional: PPM comparisons use it when it is installed, and the `array` module otherwise
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Gets the location of the `autograder` folder
 # Isn't actually necessary to run on Gradescope, but it allows for easier testing on local machines
@@ -15,35 +42,136 @@ import os
 def getAutograderDir() -> str:
     return '/'.join(__file__.split('/')[:-3])
 
-# Checks if all the expected files are present, and raises an error if any of them are missing
-# Is used by the `test_checkFiles` test case
-def checkFiles(files: list):
-    autograderDir = getAutograderDir()
-    submissionDir = autograderDir + '/submission/'
+# One file in a Manifest: its path, size, mode and modification time (from a single stat)
+# The SHA-256 hash of its contents is worked out the first time it is needed, then kept
+class FileEntry(object):
+    def __init__(self, path, stat):
+        self.path = path
+        self.size = stat.st_size
+        self.mode = stat.st_mode
+        self.mtime = stat.st_mtime
+        self._hash = None
+
+    @property
+    def hash(self):
+        if self._hash is None:
+            self._hash = hashFile(self.path)
+        return self._hash
+
+    def isExecutable(self):
+        return bool(self.mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH))
+
+# Index of the files under a folder, so file checks don't walk (or stat) the same folders again and again
+# Each folder is read once with os.scandir, the first time a file in it is looked up (or every file is listed)
+# Symbolic links to folders are not followed, like os.walk
+class Manifest(object):
+    def __init__(self, root):
+        self.root = root
+        # (files by name, subfolder names) of every folder read so far, by path relative to root ('' for root)
+        self.directories = {}
+        self.filesByName = None
+
+    # Reads one folder (relative to root), or returns it if it was already read
+    def directory(self, relative=''):
+        listing = self.directories.get(relative)
+        if listing is None:
+            files, subdirectories = {}, []
+            try:
+                with os.scandir(os.path.join(self.root, relative)) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir():
+                                if not entry.is_symlink():
+                                    subdirectories.append(entry.name)
+                            elif entry.is_file():
+                                files[entry.name] = FileEntry(entry.path, entry.stat())
+                        except OSError:
+                            pass
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+            listing = self.directories[relative] = (files, subdirectories)
+        return listing
+
+    # Gets the FileEntry of a file (path relative to root, like './main.out'), or None if there is no such file
+    def get(self, path):
+        relative = os.path.normpath(path)
+        if os.path.isabs(relative) or relative.startswith('..'):
+            return None
+        return self.directory(os.path.dirname(relative))[0].get(os.path.basename(relative))
+
+    # Lists the FileEntry of every file under root
+    def files(self):
+        pending = ['']
+        while pending:
+            relative = pending.pop()
+            files, subdirectories = self.directory(relative)
+            yield from files.values()
+            pending.extend(os.path.join(relative, name) for name in subdirectories)
+
+    # Gets the FileEntry of every file with a given name, in any folder under root
+    def find(self, name):
+        if self.filesByName is None:
+            filesByName = {}
+            for entry in self.files():
+                filesByName.setdefault(os.path.basename(entry.path), []).append(entry)
+            self.filesByName = filesByName
+        return self.filesByName.get(name, [])
+
+# Gets the manifest of the `submission` folder, which is read once per run (the submission never changes)
+@lru_cache(maxsize=None)
+def submissionManifest():
+    return Manifest(getAutograderDir() + '/submission/')
+
+# Name of the file (in `source/`) where stage_submission.py lists the files inside the submission's archives
+# (the same name as `archiveContentsName` in stage_submission.py)
+archiveContentsName = '.archive_contents'
+
+# Gets the names of the files inside the archives of the submission, which are read once per run
+@lru_cache(maxsize=None)
+def archiveFileNames():
+    try:
+        with open(getAutograderDir() + '/source/' + archiveContentsName) as file:
+            return frozenset(os.path.basename(line.rstrip('\n')) for line in file)
+    except FileNotFoundError:
+        return frozenset()
+
+_workingManifest = None
 
-    # Array containing the full path location for every submitted file. Typically is `/autograder/submission/myFile`,
-    # but this is written to be more robust to allow for easier local testing
-    allFiles = [os.path.join(dp, f) for dp, dn, filenames in os.walk(submissionDir) for f in filenames]
+# Gets the manifest of the working directory (the `source` folder the tests run in)
+# It is thrown away whenever the student's program or `make` runs (see invalidateWorkingManifest), since they
+# can create, change or remove files
+def workingManifest():
+    global _workingManifest
+    manifest = _workingManifest
+    if manifest is None:
+        manifest = _workingManifest = Manifest('.')
+    return manifest
 
-    # Array containing the full path to every file that the student submitted that was *expected*
-    # In other words, this array discards any files submitted that weren't expected to be submitted
-    submittedFiles = [i for i in allFiles if i.split('/')[-1] in files]
+# Makes the next workingManifest() call read the working directory again
+def invalidateWorkingManifest():
+    global _workingManifest
+    _workingManifest = None
 
-    # This seems weird - it should yield the exact same array as `submittedFiles`, unsure why this exists lol
-    filesSubmitted = list()
-    for file in files:
-        for fileDir in submittedFiles:
-            if fileDir.split('/')[-1] == file:
-                filesSubmitted.append(fileDir.split('/')[-1])
+# Gets the FileEntry of a file in the working directory, or None if there is no such file
+def workingFile(path):
+    return workingManifest().get(path)
+
+# Checks if all the expected files are present, and raises an error if any of them are missing
+# Is used by the `test_checkFiles` test case
+# A file counts as submitted if a file with its name is in any folder of the submission, or in any of its archives
+@tracing.traced()
+def checkFiles(files: list):
+    manifest = submissionManifest()
 
     # Get list of expected files that are missing from submission
-    filesMissing = [file for file in files if file not in filesSubmitted]
+    filesMissing = [file for file in files if not manifest.find(file) and file not in archiveFileNames()]
 
     # If any files are missing, throw an error and display the missing files
     if len(filesMissing) != 0:
         raise AssertionError("\n" + wrap("You are missing the following files:\n{}".format(', '.join(filesMissing)), 65))
 
 # Function that uses checkFiles to determine whether the compile test should continue
+@tracing.traced()
 def checkSourceFiles(utest, files: list):
     try:
         checkFiles([file for file in files if file.endswith('.c') or file == 'Makefile' or file == 'makefile'])
@@ -51,13 +179,910 @@ def checkSourceFiles(utest, files: list):
         utest.assertTrue(False, msg=wrap(filesMissingErrorMessage, 65))
         
 # Function that checks for the existence of executables to determine whether an output test should continue
-def checkExecutables(utest, executables: list):
-    if not executables:
+# Pass `executables=None` to check the executables the compile test built (see builtExecutables)
+@tracing.traced()
+def checkExecutables(utest, executables: list = None):
+    if not executablesBuilt(executables):
         utest.assertTrue(False, msg=wrap(compileFailedErrorMessage, 65))
-    
+
+# Determines whether the executables an output test needs exist (the check behind checkExecutables)
+# Pass `executables=None` to check the executables the compile test built (see builtExecutables)
+def executablesBuilt(executables: list = None):
+    if executables is None:
+        executables = builtExecutables
+    manifest = workingManifest()
+    return bool(executables) and all(manifest.get(executable) is not None for executable in executables)
+
+# Directory that holds the results of student program runs, shared by every test (and every test process)
+runCacheDir = getAutograderDir() + '/run_cache/'
+
+# Every run of the student's program (and of `make`) since the current test started, with the resources it used
+# The test runner (see parallel_runner.py) clears this list when a test starts and adds it to the test's results
+programRuns = []
+
+# Result of one run of the student's program
+# Has the same `returncode`, `kill()` and `terminate()` as the `subprocess.Popen` object it replaces,
+# so it can be passed to `checkRuntimeErrors` and `kill_fail` unchanged
+# `userTime` and `systemTime` are CPU seconds and `maxMemory` is the peak resident set size in KiB (from os.wait4)
+class ProgramRun(object):
+    def __init__(self, returncode, stdout, stderr, elapsed, outputTooLarge=False, divergedAt=None, cached=False,
+                 userTime=None, systemTime=None, maxMemory=None, limitExceeded=None, limits=None, leftoverProcesses=0, args=None):
+        # Command line the program was run with, like `Popen.args`
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.elapsed = elapsed
+        self.userTime = userTime
+        self.systemTime = systemTime
+        self.maxMemory = maxMemory
+        self.outputTooLarge = outputTooLarge
+        # Index of the first normalized output line that could not match the reference (see StreamingComparison),
+        # if the program was stopped there
+        self.divergedAt = divergedAt
+        self.cached = cached
+        # Resource limit the program was stopped for ('cpu', 'fileSize' or 'memory'; see limitExceeded),
+        # and the limits it ran with
+        self.limitExceeded = limitExceeded
+        self.limits = limits
+        # Number of processes the program left running when it exited on its own (they were killed), which
+        # checkRuntimeErrors reports in the output of the test that checks the run
+        self.leftoverProcesses = leftoverProcesses
+
+    # The program has always exited (and been reaped) by the time a ProgramRun exists,
+    # so there is nothing left to kill
+    def kill(self):
+        pass
+
+    def terminate(self):
+        pass
+
+# Returns the SHA-256 hash of a file's contents
+def hashFile(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Gets the SHA-256 hash of a file named on a command line (like an input file passed to the program), or None
+# if the argument isn't the path of a file
+def argumentFileHash(arg):
+    entry = workingFile(arg)
+    if entry is not None:
+        return entry.hash
+    if os.path.isabs(arg) and os.path.isfile(arg):
+        return hashFile(arg)
+    return None
+
+# Builds the run cache key from the contents of the executables, the command line (with the contents of the files
+# it names, and of the makefile for `make` commands), the contents of stdin, the output byte budget, the resource
+# limits and the reference the output is compared with while it streams (if any)
+def runCacheKey(args: list, stdin=None, executables: list = (), maxOutputBytes=None, compareWith=None, compareStream='stdout', limits=None):
+    digest = hashlib.sha256()
+    digest.update(str(maxOutputBytes).encode() + b'\1')
+    digest.update(repr(sorted((limits or {}).items())).encode() + b'\1')
+    if compareWith:
+        digest.update(compareStream.encode() + b'\0' + hashFile(compareWith).encode() + b'\1')
+    manifest = workingManifest()
     for executable in executables:
-        if not Path(executable).is_file():
-            utest.assertTrue(False, msg=wrap(compileFailedErrorMessage, 65))
+        entry = manifest.get(executable)
+        digest.update(executable.encode() + b'\0')
+        digest.update((entry.hash if entry else '').encode() + b'\0')
+    digest.update(b'\1')
+    for arg in args:
+        digest.update(arg.encode() + b'\0')
+        digest.update((argumentFileHash(arg) or '').encode() + b'\0')
+    digest.update(b'\1')
+    if args and os.path.basename(args[0]) == 'make':
+        for name in makefileNames:
+            entry = manifest.get(name)
+            digest.update(name.encode() + b'\0' + (entry.hash if entry else '').encode() + b'\0')
+    digest.update(b'\1')
+    digest.update((hashFile(stdin) if stdin else '').encode())
+    return digest.hexdigest()
+
+# Kills every process in the process group led by `proc`
+def killProcessGroup(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+# Returns the PIDs of the live (non-zombie) processes in process group `pgid`
+def processGroupMembers(pgid):
+    members = []
+    if not os.path.isdir('/proc'):
+        return members
+    for entry in os.scandir('/proc'):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open('/proc/' + entry.name + '/stat', 'rb') as file:
+                stat = file.read()
+        except OSError:
+            continue
+        # Fields after the command name: state, ppid, pgrp, ...
+        fields = stat[stat.rfind(b')') + 2:].split()
+        if len(fields) > 2 and fields[0] != b'Z' and int(fields[2]) == pgid:
+            members.append(int(entry.name))
+    return members
+
+# Waits for `proc` to exit and reaps it with os.wait4, which also returns the resources it used
+# (including those of the processes it started and waited for, like `make` -> `./main.out`)
+# Sets `proc.returncode` like `Popen.wait()` does, and stores the resource usage in `proc.rusage`
+def waitForExit(proc):
+    if proc.returncode is None:
+        try:
+            pid, status, proc.rusage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+        except ChildProcessError:
+            proc.wait()
+    return proc.returncode
+
+# Adds a run of a program to `programRuns`, so its resource usage ends up in results.json
+def recordProgramRun(args: list, run):
+    programRuns.append({
+        'command': ' '.join(args),
+        'returncode': run.returncode,
+        'wall_time': round(run.elapsed, 4),
+        'user_time': run.userTime,
+        'system_time': run.systemTime,
+        'max_rss_kb': run.maxMemory,
+        'cached': run.cached,
+        'limit_exceeded': run.limitExceeded,
+        'leftover_processes': run.leftoverProcesses,
+    })
+
+# Kills and reaps `proc` along with every process it started, if it was started in its own session
+# or process group (`start_new_session=True`); otherwise only `proc` itself is killed
+# Returns the number of processes (other than `proc`) that were still running and had to be killed
+def reapProcessGroup(proc):
+    members = processGroupMembers(proc.pid)
+    leftovers = len([pid for pid in members if pid != proc.pid])
+    try:
+        ownGroup = bool(members) or (proc.poll() is None and os.getpgid(proc.pid) == proc.pid)
+    except ProcessLookupError:
+        ownGroup = False
+
+    if ownGroup:
+        killProcessGroup(proc)
+    proc.kill()
+    waitForExit(proc)
+    return leftovers
+
+# Default number of bytes kept from each of stdout and stderr; a program that prints more is killed
+maxOutputBytes = 8 * 1024 * 1024
+
+# Default kernel resource limits of every run of the student's program, set before it starts (see limitedCommand)
+# 'cpu' is in CPU seconds, 'memory' (address space) and 'fileSize' (largest file it may write) are in bytes,
+# 'openFiles' is the number of open file descriptors and 'processes' the number of processes of the user
+# Change a limit for one run with runProgram(..., limits={'memory': ...}); a limit set to None is not applied
+# The CPU limit is a safety net for tests without a watchdog and is higher than the sample tests' 10 second timeout
+# The process limit is off by default: it counts every process and thread of the user (including the autograder's
+# own, and other submissions graded by regrade.py as the same user), so a low limit makes fork fail for everyone,
+# and it is not enforced for root (which runs the autograder on Gradescope)
+resourceLimits = {
+    'cpu': 20,
+    'memory': 2 * 1024 * 1024 * 1024,
+    'fileSize': 64 * 1024 * 1024,
+    'openFiles': 256,
+    'processes': None,
+}
+
+# Resource limits of `make` and the compiler (see runMake), which override resourceLimits
+# None of the student program's limits apply: compiling a large submission can take more CPU time, memory and open
+# files than running it, and the compile test has a timeout of its own
+compileResourceLimits = dict.fromkeys(resourceLimits)
+
+# setrlimit resource behind each limit
+# Note that RLIMIT_NPROC counts every process (and thread) of the user, and is not enforced for root
+resourceLimitTypes = {
+    'cpu': resource.RLIMIT_CPU,
+    'memory': resource.RLIMIT_AS,
+    'fileSize': resource.RLIMIT_FSIZE,
+    'openFiles': resource.RLIMIT_NOFILE,
+    'processes': resource.RLIMIT_NPROC,
+}
+
+# `prlimit` option behind each limit
+resourceLimitOptions = {
+    'cpu': '--cpu',
+    'memory': '--as',
+    'fileSize': '--fsize',
+    'openFiles': '--nofile',
+    'processes': '--nproc',
+}
+
+# Path of the `prlimit` command (from util-linux), or None if it isn't installed
+prlimitCommand = which('prlimit')
+
+# Peak address space (as a fraction of the memory limit) above which a crash is blamed on running out of memory
+memoryLimitCrashFraction = 0.9
+
+# Seconds between two samples of the peak address space of a program that runs under a memory limit
+# (see sampleAddressSpace)
+addressSpaceSampleInterval = 0.005
+
+# Merges the limits of one run into the default resourceLimits, leaving out limits that are off
+def effectiveLimits(limits=None):
+    merged = dict(resourceLimits, **(limits or {}))
+    for name in merged:
+        if name not in resourceLimitTypes:
+            raise ValueError('Unknown resource limit: ' + name)
+    return {name: value for name, value in merged.items() if value is not None}
+
+# Works out the (name, soft, hard) setting of every limit in `limits`
+# Soft limits are never raised above the hard limits this process already has
+# The hard CPU limit is one second above the soft limit, so a program that ignores SIGXCPU is killed
+def limitSettings(limits):
+    settings = []
+    for name, value in limits.items():
+        soft, hard = value, value + 1 if name == 'cpu' else value
+        currentHard = resource.getrlimit(resourceLimitTypes[name])[1]
+        if currentHard != resource.RLIM_INFINITY:
+            soft, hard = min(soft, currentHard), min(hard, currentHard)
+        settings.append((name, soft, hard))
+    return settings
+
+# Gets the command line that runs `args` under `limits`: `prlimit` sets the limits, then executes the program in
+# its place (same process, same return code), so no Python code has to run in the forked child (a `preexec_fn`
+# isn't safe in a process with threads, like the watchdog's or the execution plan's)
+# Without `prlimit`, the command is returned unchanged and applyLimits sets the limits once the program has started
+def limitedCommand(args: list, limits):
+    if not limits or prlimitCommand is None:
+        return args
+    return [prlimitCommand] + ['%s=%d:%d' % (resourceLimitOptions[name], soft, hard) for name, soft, hard in limitSettings(limits)] + ['--'] + args
+
+# Sets `limits` on a program that was started without `prlimit` (see limitedCommand)
+# The program runs without them for the moment between its start and this call
+def applyLimits(proc, limits):
+    if not limits or prlimitCommand is not None:
+        return
+    for name, soft, hard in limitSettings(limits):
+        try:
+            resource.prlimit(proc.pid, resourceLimitTypes[name], (soft, hard))
+        except (ProcessLookupError, PermissionError):
+            pass
+
+# Reads the peak address space of a running process (`VmPeak`, in bytes) into `proc.peakAddressSpace`
+# The kernel keeps the peak itself, so the last sample before the program exits covers every allocation before it
+# (a process that has exited has no address space left to read, so it has to be sampled while it runs)
+# Only programs with a memory limit are sampled (see startProgram)
+def sampleAddressSpace(proc):
+    if not getattr(proc, 'sampleAddressSpace', False):
+        return
+    try:
+        with open('/proc/%d/status' % proc.pid, 'rb') as file:
+            for line in file:
+                if line.startswith(b'VmPeak:'):
+                    proc.peakAddressSpace = max(proc.peakAddressSpace, int(line.split()[1]) * 1024)
+                    return
+    except (OSError, ValueError, IndexError):
+        pass
+
+# Works out which resource limit (if any) stopped a program: 'cpu', 'fileSize' or 'memory'
+# SIGXCPU and SIGXFSZ are sent by the kernel at the CPU and file size limits, and SIGKILL at the hard CPU limit
+# Any other SIGKILL the autograder didn't send itself comes from the out-of-memory killer, and a program that
+# crashes after its address space came close to the limit most likely crashed because an allocation failed
+# (a failed allocation leaves the resident set far below the limit, so `peakAddressSpace` is checked as well as it)
+def limitExceeded(returncode, rusage, limits, killedByAutograder, peakAddressSpace=0):
+    if returncode == -signal.SIGXCPU:
+        return 'cpu'
+    if returncode == -signal.SIGXFSZ:
+        return 'fileSize'
+    cpuTime = rusage.ru_utime + rusage.ru_stime if rusage else 0
+    if returncode == -signal.SIGKILL and not killedByAutograder:
+        return 'cpu' if 'cpu' in limits and cpuTime >= limits['cpu'] else 'memory'
+    if returncode in (-signal.SIGSEGV, -signal.SIGABRT, -signal.SIGBUS) and 'memory' in limits:
+        peak = max(peakAddressSpace or 0, rusage.ru_maxrss * 1024 if rusage else 0)
+        if peak >= limits['memory'] * memoryLimitCrashFraction:
+            return 'memory'
+    return None
+
+# Collects stdout and stderr of a program in chunks as they arrive, keeping at most `budget` bytes of each
+# If either stream goes over budget, the program has to be stopped right away instead of being allowed to fill
+# memory until the test times out
+# If `comparison` (a StreamingComparison) is given, `comparedStream` ('stdout' or 'stderr') is fed to it as it
+# arrives, and the program has to be stopped as soon as a line cannot match the reference
+# Shared by captureOutput (selectors) and captureOutputAsync (asyncio)
+class OutputCapture(object):
+    def __init__(self, proc, budget, comparison=None, comparedStream='stdout'):
+        self.proc = proc
+        self.buffers = {proc.stdout: bytearray(), proc.stderr: bytearray()}
+        self.budget = budget
+        self.comparison = comparison
+        self.compared = getattr(proc, comparedStream) if comparison else None
+        self.stopReason = None
+
+    # Handles a chunk read from `stream` (b'' when the stream is closed)
+    # Returns True once the program has to be stopped
+    def feed(self, stream, chunk):
+        if not chunk:
+            if stream is self.compared and not self.comparison.finish():
+                self.stopReason = 'diverged'
+        else:
+            buffer = self.buffers[stream]
+            buffer += chunk
+            if len(buffer) > self.budget:
+                del buffer[self.budget:]
+                self.stopReason = 'outputTooLarge'
+            elif stream is self.compared and not self.comparison.feed(chunk):
+                self.stopReason = 'diverged'
+        return self.stopReason is not None
+
+    # Returns (stdout, stderr, stopReason), where stopReason is None, 'outputTooLarge' or 'diverged'
+    def result(self):
+        return bytes(self.buffers[self.proc.stdout]), bytes(self.buffers[self.proc.stderr]), self.stopReason
+
+# Reads stdout and stderr of `proc` as they arrive (see OutputCapture) and waits for it to exit
+# A program that has to be stopped is killed (along with everything it started) right away
+# A program with a memory limit has its address space sampled while it runs (see sampleAddressSpace)
+# Returns (stdout, stderr, stopReason), where stopReason is None, 'outputTooLarge' or 'diverged'
+def captureOutput(proc, budget, comparison=None, comparedStream='stdout'):
+    capture = OutputCapture(proc, budget, comparison, comparedStream)
+    interval = addressSpaceSampleInterval if getattr(proc, 'sampleAddressSpace', False) else None
+    with selectors.DefaultSelector() as selector:
+        for stream in capture.buffers:
+            selector.register(stream, selectors.EVENT_READ)
+        while selector.get_map() and capture.stopReason is None:
+            sampleAddressSpace(proc)
+            for key, events in selector.select(interval):
+                chunk = os.read(key.fd, 1 << 16)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                if capture.feed(key.fileobj, chunk):
+                    killProcessGroup(proc)
+                    break
+    proc.stdout.close()
+    proc.stderr.close()
+    waitForExit(proc)
+    return capture.result()
+
+# Waits for `proc` to exit without blocking the event loop, then reaps it with waitForExit (so its resource
+# usage is still recorded). Waits on a pidfd (readable once the process exits) where the system has them,
+# and in a worker thread otherwise
+async def waitForExitAsync(proc):
+    loop = asyncio.get_running_loop()
+    try:
+        pidfd = os.pidfd_open(proc.pid)
+    except (AttributeError, OSError):
+        await loop.run_in_executor(None, waitForExit, proc)
+        return
+    try:
+        exited = loop.create_future()
+        loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+        try:
+            await exited
+        finally:
+            loop.remove_reader(pidfd)
+    finally:
+        os.close(pidfd)
+    waitForExit(proc)
+
+# Same as captureOutput, but reads stdout and stderr on the running asyncio event loop, so many programs
+# can be captured at once by one thread
+async def captureOutputAsync(proc, budget, comparison=None, comparedStream='stdout'):
+    loop = asyncio.get_running_loop()
+    capture = OutputCapture(proc, budget, comparison, comparedStream)
+    openStreams = set(capture.buffers)
+    closed = loop.create_future()
+
+    def onReadable(stream):
+        try:
+            chunk = os.read(stream.fileno(), 1 << 16)
+        except BlockingIOError:
+            return
+        if not chunk:
+            loop.remove_reader(stream.fileno())
+            openStreams.discard(stream)
+        stop = capture.feed(stream, chunk)
+        if stop:
+            killProcessGroup(proc)
+        if (stop or not openStreams) and not closed.done():
+            closed.set_result(None)
+
+    sampler = None
+    def sample():
+        nonlocal sampler
+        sampleAddressSpace(proc)
+        sampler = loop.call_later(addressSpaceSampleInterval, sample)
+
+    for stream in capture.buffers:
+        os.set_blocking(stream.fileno(), False)
+        loop.add_reader(stream.fileno(), onReadable, stream)
+    if getattr(proc, 'sampleAddressSpace', False):
+        sample()
+    try:
+        await closed
+    finally:
+        if sampler is not None:
+            sampler.cancel()
+        for stream in capture.buffers:
+            loop.remove_reader(stream.fileno())
+        proc.stdout.close()
+        proc.stderr.close()
+    await waitForExitAsync(proc)
+    return capture.result()
+
+# Starts the student's program in its own session, under the resource limits `limits` (see limitedCommand)
+def startProgram(args: list, stdinFile, limits):
+    with tracing.span('start process', command=' '.join(args)):
+        proc = subprocess.Popen(limitedCommand(args, limits), stdin=stdinFile, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+        applyLimits(proc, limits)
+        proc.sampleAddressSpace = bool(limits) and 'memory' in limits
+        proc.peakAddressSpace = 0
+        return proc
+
+# Kills and reaps whatever the student's program left running, then records the run (with the resources it used)
+# Runs that time out are recorded too (without output), so their resource usage is still reported
+def finishProgram(args: list, proc, start, limits, killedByAutograder):
+    with tracing.span('reap processes'):
+        leftovers = reapProcessGroup(proc)
+    invalidateWorkingManifest()
+    rusage = getattr(proc, 'rusage', None)
+    run = ProgramRun(proc.returncode, b'', b'', time.monotonic() - start,
+                     userTime=rusage and round(rusage.ru_utime, 4), systemTime=rusage and round(rusage.ru_stime, 4),
+                     maxMemory=rusage and rusage.ru_maxrss, limits=limits,
+                     limitExceeded=limitExceeded(proc.returncode, rusage, limits, killedByAutograder, proc.peakAddressSpace),
+                     leftoverProcesses=0 if killedByAutograder else leftovers, args=args)
+    recordProgramRun(args, run)
+    return run
+
+# Adds the output of a finished program to its run
+def completeRun(run, stdout, stderr, stopReason, comparison):
+    run.stdout, run.stderr = stdout, stderr
+    run.outputTooLarge = stopReason == 'outputTooLarge'
+    run.divergedAt = comparison.divergedAt if stopReason == 'diverged' else None
+    return run
+
+# Runs the student's program once, with the contents of the file `stdin` (if any) as stdin,
+# and waits for it to exit
+# The program runs in its own session, so the whole tree it starts (like `make` -> `./main.out`) can be killed
+# at once: by the watchdog at the deadline of a `@timeout.timeout(..., use_watchdog=True)` test, when a
+# `use_signals=False` test is cancelled, or when the program exits but leaves processes running behind it
+def executeProgram(args: list, stdin=None, maxOutputBytes=maxOutputBytes, compareWith=None, compareStream='stdout', limits=None):
+    comparison = StreamingComparison(compareWith) if compareWith else None
+    limits = effectiveLimits(limits)
+    stopReason = None
+    watchdogKilled = []
+    def watchdogKill():
+        watchdogKilled.append(True)
+        killProcessGroup(proc)
+
+    with open(stdin, 'rb') if stdin else open(os.devnull, 'rb') as stdinFile:
+        start = time.monotonic()
+        proc = startProgram(args, stdinFile, limits)
+        try:
+            with timeout.watch(watchdogKill), tracing.span('run process', command=' '.join(args)):
+                stdout, stderr, stopReason = captureOutput(proc, maxOutputBytes, comparison, compareStream)
+        finally:
+            run = finishProgram(args, proc, start, limits, bool(stopReason or watchdogKilled))
+    return completeRun(run, stdout, stderr, stopReason, comparison)
+
+# Same as executeProgram, but on the running asyncio event loop, with a deadline of `seconds` (None for none)
+# A program still running at its deadline is killed (with everything it started), and the timeout exception
+# (timeout.TimeoutError, with the same message as the output tests' `@timeout.timeout`) is raised
+async def executeProgramAsync(args: list, stdin=None, maxOutputBytes=maxOutputBytes, compareWith=None, compareStream='stdout', limits=None,
+                              seconds=None):
+    comparison = StreamingComparison(compareWith) if compareWith else None
+    limits = effectiveLimits(limits)
+    stopReason = None
+    timedOut = False
+
+    with open(stdin, 'rb') if stdin else open(os.devnull, 'rb') as stdinFile:
+        start = time.monotonic()
+        proc = startProgram(args, stdinFile, limits)
+        runStart = time.monotonic_ns()
+        try:
+            stdout, stderr, stopReason = await asyncio.wait_for(captureOutputAsync(proc, maxOutputBytes, comparison, compareStream), seconds)
+        except asyncio.TimeoutError:
+            timedOut = True
+            killProcessGroup(proc)
+            raise timeout.TimeoutError(wrap(programTimeoutErrorMessage, 65))
+        finally:
+            # Programs run at the same time on one thread, so each one's span gets a lane of its own (its PID)
+            if tracing.enabled:
+                tracing.record('run process', 'phase', runStart, time.monotonic_ns(), {'command': ' '.join(args)}, tid=proc.pid)
+            run = finishProgram(args, proc, start, limits, bool(stopReason or timedOut))
+    return completeRun(run, stdout, stderr, stopReason, comparison)
+
+# Runs the student's program and returns a ProgramRun with its stdout, stderr, return code and run time
+# Runs with the same executables (by content), command line and stdin (by content) share one result, so tests
+# that check different parts of the same output only run the program once
+# Pass `cache=False` for tests that rely on the program's side effects (like files it creates)
+# At most `maxOutputBytes` of each of stdout and stderr are kept; see captureOutput
+# Pass the path of a reference file as `compareWith` to compare `compareStream` ('stdout' or 'stderr') with it
+# while the program runs, and stop the program at the first line that cannot match (see StreamingComparison)
+# The program runs under the kernel resource limits in `resourceLimits`, with `limits` overriding any of them
+@tracing.traced()
+def runProgram(args: list, stdin=None, executables: list = (), cache=True, maxOutputBytes=maxOutputBytes, compareWith=None, compareStream='stdout',
+               limits=None):
+    if not cache:
+        return executeProgram(args, stdin, maxOutputBytes, compareWith, compareStream, limits)
+
+    path = runCachePath(args, stdin, executables, maxOutputBytes, compareWith, compareStream, limits)
+
+    # Hold a lock on the key while running, so concurrent tests with the same run wait for one result
+    # instead of all running the program
+    with open(path + '.lock', 'wb') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        run = loadCachedRun(args, path)
+        if run is None:
+            run = executeProgram(args, stdin, maxOutputBytes, compareWith, compareStream, limits)
+            storeCachedRun(path, run)
+        return run
+
+# Gets the path of a run in the run cache (see runCacheKey)
+def runCachePath(args: list, stdin=None, executables: list = (), maxOutputBytes=None, compareWith=None, compareStream='stdout', limits=None):
+    os.makedirs(runCacheDir, exist_ok=True)
+    return runCacheDir + runCacheKey(args, stdin, executables, maxOutputBytes, compareWith, compareStream, effectiveLimits(limits))
+
+# Gets a run from the run cache (and records it), or returns None if it isn't cached
+def loadCachedRun(args: list, path):
+    try:
+        with open(path, 'rb') as file:
+            run = ProgramRun(**pickle.load(file), cached=True)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+    recordProgramRun(args, run)
+    return run
+
+# Stores a run in the run cache
+# Runs that time out never get here, so only completed runs are cached
+def storeCachedRun(path, run):
+    temp = path + '.' + str(os.getpid())
+    with open(temp, 'wb') as file:
+        pickle.dump({key: value for key, value in vars(run).items() if key != 'cached'}, file)
+    os.replace(temp, path)
+
+# Same as runProgram, but on the running asyncio event loop, with a deadline of `seconds` (see executeProgramAsync)
+async def runProgramAsync(args: list, stdin=None, executables: list = (), cache=True, maxOutputBytes=maxOutputBytes, compareWith=None,
+                          compareStream='stdout', limits=None, seconds=None):
+    if not cache:
+        return await executeProgramAsync(args, stdin, maxOutputBytes, compareWith, compareStream, limits, seconds)
+
+    path = runCachePath(args, stdin, executables, maxOutputBytes, compareWith, compareStream, limits)
+    with open(path + '.lock', 'wb') as lock:
+        # Another process may hold the lock while it runs the same program, so wait for it off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, fcntl.flock, lock, fcntl.LOCK_EX)
+        run = loadCachedRun(args, path)
+        if run is None:
+            run = await executeProgramAsync(args, stdin, maxOutputBytes, compareWith, compareStream, limits, seconds)
+            storeCachedRun(path, run)
+        return run
+
+# Runs several programs at the same time on one asyncio event loop, each with its own deadline
+# Every run is a dict of runProgram arguments, plus `seconds` (its time limit)
+# At most `jobs` programs run at once (None = one per available core), so runs don't compete for the cores and miss
+# their deadlines; a run's deadline starts when it starts, not while it waits for a core
+# Returns the ProgramRun of every run, in order, or the exception it raised (like the timeout exception)
+def runProgramsConcurrently(runs: list, jobs=None):
+    async def runAll():
+        semaphore = asyncio.Semaphore(jobs or availableCores())
+        async def runOne(run):
+            async with semaphore:
+                return await runProgramAsync(**run)
+        return await asyncio.gather(*(runOne(run) for run in runs), return_exceptions=True)
+    return asyncio.run(runAll())
+
+# Names `make` looks for, in order
+makefileNames = ['GNUmakefile', 'makefile', 'Makefile']
+
+# Characters that mean a recipe needs a shell to run
+shellCharacters = set('|&;<>()$`\\"\'*?[]#~\n')
+
+# Reads variable assignments, target recipes and target prerequisites from the makefile in the current directory
+# Target and prerequisite names are expanded with the variables assigned before them (like `$(PROGRAM): main.c`)
+# Returns (variables, recipes, prerequisites), or None if there is no makefile
+def parseMakefile():
+    for name in makefileNames:
+        if Path(name).is_file():
+            break
+    else:
+        return None
+
+    variables = {}
+    recipes = {}
+    prerequisites = {}
+    target = None
+    with open(name, 'r', errors='replace') as file:
+        for line in file:
+            line = line.rstrip('\n')
+            if line.startswith('\t'):
+                if target is not None:
+                    recipes[target].append(line.strip())
+                continue
+            stripped = line.split('#', 1)[0].strip()
+            if not stripped:
+                continue
+            assignment = re.match(r'^([A-Za-z_][A-Za-z0-9_]*)\s*[:?+]?=\s*(.*)$', stripped)
+            if assignment:
+                variables[assignment.group(1)] = assignment.group(2).strip()
+                target = None
+            elif ':' in stripped:
+                targets, dependencies = stripped.split(':', 1)
+                dependencies, _, command = dependencies.partition(';')
+                targets = expandMakeVariables(targets, variables).split()
+                target = targets[0] if len(targets) == 1 else None
+                if target is not None:
+                    recipes[target] = [command.strip()] if command.strip() else []
+                    prerequisites[target] = expandMakeVariables(dependencies, variables).split()
+            else:
+                target = None
+    return variables, recipes, prerequisites
+
+# Expands `$(VAR)` and `${VAR}` references using the makefile's variables (and the environment, like make)
+def expandMakeVariables(text, variables, depth=0):
+    def expand(match):
+        name = match.group(1) or match.group(2)
+        value = variables.get(name, os.environ.get(name, ''))
+        return expandMakeVariables(value, variables, depth + 1) if depth < 16 else value
+    return re.sub(r'\$\(([A-Za-z0-9_]+)\)|\$\{([A-Za-z0-9_]+)\}', expand, text)
+
+# Commands of the targets makeTargetCommand resolved, by (target, executables)
+# Only resolved commands are kept: a target that falls back to `make` (for example because its executable doesn't
+# exist yet) is resolved again next time. Every compile clears it (see runTrackedMake)
+_resolvedMakeTargets = {}
+
+# Implementation of makeTargetCommand (without the cache)
+def _resolveMakeTarget(target, executables):
+    fallback = ['make', '-s', target]
+    parsed = parseMakefile()
+    if parsed is None:
+        return fallback
+    variables, recipes, prerequisites = parsed
+
+    recipe = recipes.get(target)
+    if not recipe or len(recipe) != 1:
+        return fallback
+    command = expandMakeVariables(recipe[0], variables).lstrip('@-+ ')
+    if not command or any(character in shellCharacters for character in command):
+        return fallback
+
+    args = shlex.split(command)
+    program = os.path.normpath(args[0])
+    if not args[0].startswith('./') or not Path(program).is_file() or not os.access(program, os.X_OK):
+        return fallback
+    if executables and program not in [os.path.normpath(executable) for executable in executables]:
+        return fallback
+    return args
+
+# Resolves `make -s <target>` to the command its recipe runs, so the student's program can be executed
+# directly instead of through `/bin/sh` and `make` (which re-reads the makefile and checks dependencies every run)
+# Only recipes that are a single plain command running a compiled executable (like `./$(PROGRAM) noinput`)
+# are resolved; anything else (several commands, shell syntax, other programs) falls back to
+# `['make', '-s', target]`. If `executables` is given, the command must run one of them
+def makeTargetCommand(target: str, executables: list = ()):
+    key = (target, tuple(executables))
+    args = _resolvedMakeTargets.get(key)
+    if args is None:
+        args = _resolveMakeTarget(*key)
+        if args[0] != 'make':
+            _resolvedMakeTargets[key] = args
+    return list(args)
+
+# Directory that holds the executables and compiler output of earlier compiles, keyed by compileCacheKey
+# Set AUTOGRADER_COMPILE_CACHE to share one cache between several autograder folders (like regrade.py does)
+compileCacheDir = os.path.join(os.environ.get('AUTOGRADER_COMPILE_CACHE', getAutograderDir() + '/compile_cache'), '')
+
+# Files whose contents are part of the compile cache key (along with the makefile)
+compileSourcePatterns = ['*.c', '*.h']
+
+# Environment variables that change how `make` compiles, which are part of the compile cache key
+compileEnvironment = ['CC', 'CFLAGS', 'CPPFLAGS', 'LDFLAGS', 'LDLIBS', 'MAKEFLAGS']
+
+# Gets the version output of a compiler (once per process), or an empty string if it isn't installed
+@lru_cache(maxsize=None)
+def compilerVersion(compiler):
+    try:
+        return subprocess.run([compiler, '--version'], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+    except OSError:
+        return b''
+
+# Builds the compile cache key from the contents of the source files and the makefiles in every folder of the
+# working directory, the version of the compiler the makefile uses (`CC` or `COMPILER`, plus gcc and cc), the compiler-related
+# environment variables, the make command line and the expected executables
+def compileCacheKey(args: list, executables: list = ()):
+    digest = hashlib.sha256()
+    for arg in args:
+        digest.update(arg.encode() + b'\0')
+    digest.update(b'\1')
+    for executable in executables:
+        digest.update(executable.encode() + b'\0')
+    digest.update(b'\1')
+
+    # Sources (and makefiles) in every folder of the working directory, so submissions staged with their folders
+    # (`stage_submission.py --preserve-structure`) are covered too
+    sources = sorted((os.path.normpath(entry.path), entry) for entry in workingManifest().files()
+                     if any(fnmatch.fnmatchcase(os.path.basename(entry.path), pattern) for pattern in compileSourcePatterns + makefileNames))
+    for path, entry in sources:
+        digest.update(path.encode() + b'\0' + entry.hash.encode() + b'\0')
+    digest.update(b'\1')
+
+    parsed = parseMakefile()
+    variables = parsed[0] if parsed else {}
+    compilers = {'gcc', 'cc'}
+    for name in ('CC', 'COMPILER'):
+        words = expandMakeVariables(variables.get(name, os.environ.get(name, '')), variables).split()
+        if words:
+            compilers.add(words[0])
+    for compiler in sorted(compilers):
+        digest.update(compiler.encode() + b'\0' + compilerVersion(compiler) + b'\0')
+    digest.update(b'\1')
+
+    for name in compileEnvironment:
+        digest.update(name.encode() + b'=' + os.environ.get(name, '').encode() + b'\0')
+    return digest.hexdigest()
+
+# Number of targets compileProgram builds at once; None uses one per core this process may run on
+compileJobs = None
+
+# Gets the number of cores this process may run on
+def availableCores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# Gets the targets a `make` goal (the first target, if `target` is None) is made of, in makefile order, if they
+# can be built independently of each other; returns an empty list otherwise
+# A goal is split when it has no commands of its own (like `compile: a.out b.out`, or `all: compile` leading to one),
+# and each of its prerequisites has commands and depends only on existing files that no rule builds (like `a.out: a.c`)
+def independentMakeTargets(target=None):
+    parsed = parseMakefile()
+    if parsed is None:
+        return []
+    variables, recipes, prerequisites = parsed
+
+    goal = target or next((name for name in recipes if not name.startswith('.') and '%' not in name), None)
+    while goal in recipes and not recipes[goal] and len(prerequisites[goal]) == 1:
+        goal = prerequisites[goal][0]
+    if goal not in recipes or recipes[goal]:
+        return []
+
+    units = prerequisites[goal]
+    if len(units) < 2 or len(set(units)) != len(units):
+        return []
+    for unit in units:
+        if not recipes.get(unit) or not prerequisites[unit]:
+            return []
+        if any(dependency in recipes or not Path(dependency).is_file() for dependency in prerequisites[unit]):
+            return []
+    return units
+
+# Runs `make` (or `make <target>`) and returns a ProgramRun with its combined output
+# If the goal is made of independent targets (see independentMakeTargets), they are built at the same time,
+# `jobs` at a time, before `make` builds whatever is left. Their output is combined in makefile order (not in the
+# order they finish), and ends at the first target that fails (whose later targets are removed again), like
+# a serial `make`, so the compiler output is the same on every run
+def runMake(target=None, jobs=None):
+    args = ['make'] + ([target] if target else [])
+    jobs = jobs or compileJobs or availableCores()
+    units = independentMakeTargets(target) if jobs > 1 else []
+    if not units:
+        return executeProgram(args, limits=compileResourceLimits)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=min(jobs, len(units))) as pool:
+        runs = list(pool.map(lambda unit: executeProgram(['make', unit], limits=compileResourceLimits), units))
+
+    failed = next((index for index, run in enumerate(runs) if run.returncode != 0), None)
+    if failed is None:
+        runs.append(executeProgram(args, limits=compileResourceLimits))
+    else:
+        for unit in units[failed + 1:]:
+            if Path(unit).is_file():
+                os.remove(unit)
+        invalidateWorkingManifest()
+        runs = runs[:failed + 1]
+
+    return ProgramRun(runs[-1].returncode, b''.join(run.stdout for run in runs), b''.join(run.stderr for run in runs),
+                      time.monotonic() - start, outputTooLarge=any(run.outputTooLarge for run in runs))
+
+# Executables built by the last compileProgram call (paths relative to the working directory, like 'main.out'),
+# found by comparing the working directory before and after `make`. Changed in place, so `from utils import *`
+# sees every update
+builtExecutables = []
+
+# Files that are never reported as built executables
+ignoredExecutables = {'run_autograder'}
+
+# Takes a snapshot of every executable file under `root`: maps its path to its (modification time, size)
+def snapshotExecutables(root='.'):
+    return {os.path.relpath(entry.path, root): (entry.mtime, entry.size) for entry in Manifest(root).files()
+            if entry.isExecutable() and os.path.basename(entry.path) not in ignoredExecutables}
+
+# Gets the executables that are new or changed in snapshot `after` (by default, the working directory right now)
+# compared with snapshot `before`, in path order
+def newExecutables(before, after=None):
+    after = snapshotExecutables() if after is None else after
+    return sorted(path for path, state in after.items() if before.get(path) != state)
+
+# Removes executables (like the ones a compile that was stopped part way through left behind)
+def removeExecutables(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    invalidateWorkingManifest()
+
+# Runs `make` (see runMake) between two snapshots of the working directory, and stores the executables it built
+# in `builtExecutables` (and in `run.built`)
+# If `make` built nothing (everything was up to date), `builtExecutables` keeps the executables of the last compile
+def runTrackedMake(target=None, jobs=None):
+    before = snapshotExecutables()
+    run = runMake(target, jobs)
+    run.built = newExecutables(before)
+    _resolvedMakeTargets.clear()
+    if run.built or run.returncode != 0:
+        builtExecutables[:] = run.built
+    return run
+
+# Compiles the student's program by running `make` (or `make <target>`, see runMake), and returns a ProgramRun with
+# the compiler's stdout, stderr and return code
+# The executables `make` built are stored in `builtExecutables`
+# A compile of the same sources, makefile and compiler as an earlier one (in this run, or an earlier run that used
+# the same `compileCacheDir`) doesn't run the compiler: the executables it built are copied back into place
+# (with a new modification time, so `make` still considers them up to date) and its output is returned as it was
+@tracing.traced()
+def compileProgram(executables: list, target=None, cache=True, jobs=None):
+    args = ['make'] + ([target] if target else [])
+    if not cache:
+        return runTrackedMake(target, jobs)
+
+    os.makedirs(compileCacheDir, exist_ok=True)
+    path = compileCacheDir + compileCacheKey(args, executables)
+
+    # Hold a lock on the key while compiling, so concurrent compiles of the same sources only run the compiler once
+    with open(path + '.lock', 'wb') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(path + '/result', 'rb') as file:
+                result = pickle.load(file)
+            built = result.pop('built')
+            for index, executable in enumerate(built):
+                if os.path.dirname(executable):
+                    os.makedirs(os.path.dirname(executable), exist_ok=True)
+                copy(path + '/' + str(index), executable)
+            invalidateWorkingManifest()
+            builtExecutables[:] = result.pop('discovered')
+            run = ProgramRun(**result, cached=True)
+            recordProgramRun(args, run)
+            return run
+        except (FileNotFoundError, NotADirectoryError, EOFError, pickle.UnpicklingError, KeyError):
+            pass
+
+        run = runTrackedMake(target, jobs)
+        # A `make` that found everything up to date built nothing and printed no compiler output, so it isn't cached
+        if run.returncode == 0 and not run.built:
+            return run
+
+        # Store the entry in a temporary directory first, so a cache entry is never seen half-written
+        temp = path + '.' + str(os.getpid())
+        rmtree(temp, ignore_errors=True)
+        os.makedirs(temp)
+        built = sorted(set(executable for executable in executables if Path(executable).is_file()) | set(run.built))
+        for index, executable in enumerate(built):
+            copy(executable, temp + '/' + str(index))
+        with open(temp + '/result', 'wb') as file:
+            pickle.dump(dict({key: value for key, value in vars(run).items() if key not in ('cached', 'built')}, built=built, discovered=run.built), file)
+        rmtree(path, ignore_errors=True)
+        os.replace(temp, path)
+        return run
+
+# Decorator that marks a test as independent of every other output test
+# Tests marked with `@parallel` may be run concurrently by `run_tests.py --jobs N`; unmarked tests
+# (file checks, compilation) always run first, one at a time, in `@number` order
+# Usage: @parallel()
+class parallel(object):
+    def __init__(self, val=True):
+        self.val = val
+
+    def __call__(self, func):
+        func.__parallel__ = self.val
+        return func
 
 # Series of functions that handle extra lines when comparing output with 
 # reference files
@@ -68,9 +1093,128 @@ def nonEmptyLine(s):
 def stripstr(s):
     return re.sub(' +', ' ', s.strip())
 
+# Rules understood by Normalizer
+normalizerRules = (
+    # Turn Windows line endings into plain newlines
+    'crlf',
+    # Remove whitespace at the end of every line
+    'trimTrailingWhitespace',
+    # Remove whitespace at the start and end of every line
+    'stripLines',
+    # Remove lines that are empty or only contain whitespace (the output then always ends with one newline)
+    'removeBlankLines',
+    # Collapse runs of spaces into a single space
+    'collapseSpaces',
+    # Compare case-insensitively
+    'caseFold',
+)
+
+# Rules that make Normalizer behave like the original removeEmptyLines
+defaultNormalizerRules = ('stripLines', 'collapseSpaces', 'removeBlankLines')
+
+# Output normalizer built once from a set of rules
+# Rules are names from `normalizerRules`, or functions that take and return the text (run last, in order)
+# Works on both bytes and str. All per-line rules are fused into a single split/strip/join pass, and the other
+# rules are whole-text operations in C (`replace`, `lower`), instead of running a regex on every line
+class Normalizer(object):
+    def __init__(self, rules=defaultNormalizerRules):
+        names = set(rule for rule in rules if isinstance(rule, str))
+        unknown = names.difference(normalizerRules)
+        if unknown:
+            raise ValueError('Unknown normalizer rule(s): ' + ', '.join(sorted(unknown)))
+        self.crlf = 'crlf' in names
+        self.collapseSpaces = 'collapseSpaces' in names
+        self.caseFold = 'caseFold' in names
+        self.removeBlankLines = 'removeBlankLines' in names
+        if 'stripLines' in names:
+            self.stripLine = lambda line: line.strip()
+        elif 'trimTrailingWhitespace' in names:
+            self.stripLine = lambda line: line.rstrip()
+        else:
+            self.stripLine = None
+        self.custom = [rule for rule in rules if callable(rule)]
+
+    # Applies the per-line rules to every line in one pass
+    def normalizeLines(self, text, newline):
+        lines = text.split(newline)
+        if self.stripLine is not None:
+            lines = [self.stripLine(line) for line in lines]
+        if self.removeBlankLines:
+            lines = [line for line in lines if line.strip()] if self.stripLine is None else list(filter(None, lines))
+            return newline.join(lines) + newline
+        return newline.join(lines)
+
+    @tracing.traced('normalize')
+    def __call__(self, text):
+        isBytes = isinstance(text, (bytes, bytearray))
+        newline, space, crlf = (b'\n', b' ', b'\r\n') if isBytes else ('\n', ' ', '\r\n')
+        if self.crlf:
+            text = text.replace(crlf, newline)
+        if self.stripLine is not None or self.removeBlankLines:
+            text = self.normalizeLines(text, newline)
+        if self.collapseSpaces:
+            # Every replace halves the longest run of spaces
+            doubleSpace = space + space
+            while doubleSpace in text:
+                text = text.replace(doubleSpace, space)
+        if self.caseFold:
+            text = text.lower() if isBytes else text.casefold()
+        for rule in self.custom:
+            text = rule(text)
+        return text
+
+defaultNormalizer = Normalizer()
+
+# Strips every line, collapses runs of spaces and removes blank lines
 def removeEmptyLines(text):
-    lst = filter(nonEmptyLine, list(map(stripstr, text.split("\n"))))
-    return "\n".join(list(lst)) + "\n"
+    return defaultNormalizer(text)
+
+# Number of lines kept after the first wrong line when a diff is limited by `limitToDivergence`
+divergenceContextLines = 3
+
+# Compares a program's output with a reference file line by line, as the output arrives
+# Lines are normalized with the same rules as `removeEmptyLines` (blank lines dropped, runs of spaces collapsed),
+# so a run is only stopped early when the full comparison would fail too
+class StreamingComparison(object):
+    def __init__(self, referencePath):
+        reference = open(referencePath, 'rb').read().strip().decode('utf-8')
+        self.reference = removeEmptyLines(reference).split('\n')[:-1]
+        self.lineCount = 0
+        self.divergedAt = None
+        self.partial = b''
+
+    # Checks one raw output line; returns False once the output can no longer match
+    def checkLine(self, line):
+        try:
+            line = stripstr(line.decode('utf-8'))
+        except UnicodeDecodeError:
+            # Let the full comparison report the decode error
+            line = None
+        if line == '':
+            return True
+        if line is None or self.lineCount >= len(self.reference) or line != self.reference[self.lineCount]:
+            self.divergedAt = self.lineCount
+            return False
+        self.lineCount += 1
+        return True
+
+    # Feeds a chunk of output; returns False once the output can no longer match
+    def feed(self, chunk):
+        lines = (self.partial + chunk).split(b'\n')
+        self.partial = lines.pop()
+        return self.divergedAt is None and all(self.checkLine(line) for line in lines)
+
+    # Checks the last (unterminated) line at the end of the output; returns False if the output cannot match
+    def finish(self):
+        partial, self.partial = self.partial, b''
+        return self.divergedAt is None and self.checkLine(partial)
+
+# If `run` was stopped at its first wrong line, keeps only the normalized lines up to that line plus a few lines
+# of context, so the diff shows where the output went wrong instead of everything the program never printed
+def limitToDivergence(text, run):
+    if getattr(run, 'divergedAt', None) is None:
+        return text
+    return '\n'.join(text.split('\n')[:run.divergedAt + 1 + divergenceContextLines]).rstrip('\n') + '\n'
 
 decodeErrorMessage = 'Your program printed a character that the autograder cannot decode. Ensure your program prints valid characters.'
 uninitializedCharacterMessage = 'Your program printed an uninitialized char variable, which the autograder cannot decode. Ensure your program prints valid characters.'
@@ -78,15 +1222,25 @@ compileDecodeErrorMessage = 'The compiler failed to read a character in your sou
 compileTimeoutErrorMessage = 'The autograder timed out while trying to compile your program. If your program is compiled using a makefile, ensure your makefile is not malformed.'
 programTimeoutErrorMessage = 'Your program timed out while running this test case, likely due to an infinite loop or an issue accepting inputs. Ensure your program does not loop infinitely, and make sure the test inputs are handled correctly.'
 compileFailedErrorMessage = 'The test cannot be run because the submitted program did not compile successfully. Ensure your program compiles without warnings.'
+outputTooLargeErrorMessage = 'Your program printed too much output and was stopped by the autograder, likely due to an infinite loop that prints. Ensure your program only prints the expected output.'
+leftoverProcessesMessage = 'Your program exited but left {} process(es) running in the background. They were stopped by the autograder. Ensure your program waits for any processes it starts.'
+cpuLimitErrorMessage = 'Your program used more than {} seconds of CPU time and was stopped by the autograder, likely due to an infinite loop or a very slow algorithm. Ensure your program does not loop infinitely.'
+fileSizeLimitErrorMessage = 'Your program tried to write a file larger than {} and was stopped by the autograder, likely due to an infinite loop that writes to a file. Ensure your program only writes the expected output.'
+memoryLimitErrorMessage = 'Your program ran out of memory (the limit is {}) and was stopped, likely due to allocating memory in a loop or a very large allocation. Ensure your program frees memory it no longer needs and only allocates what it uses.'
 filesMissingErrorMessage = 'Compilation cannot continue because the submission does not include all of the required files. Ensure you\'re submitting all of the correct files.'
 
+# Shell commands that find (or remove) the most recently modified executable, kept for older compile tests
+# New tests use the executables the compile built instead (see builtExecutables, newExecutables and removeExecutables)
 findLastExecutableCommand = "find -type f -executable ! -name 'run_autograder' -printf '%T@ %p\n' | sort -n | tail -1 | awk '{print $2}'"
 removeLastExecutableCommand = "find -type f -executable ! -name 'run_autograder' -printf '%T@ %p\n' | sort -n | tail -1 | awk '{print $2}' | xargs rm -r"
 
-# Function that kills the process that runs the student's program,
+# Function that kills the process that runs the student's program (and every process it started),
 # then fails the test with a pre-defined message
 def kill_fail(proc, utest, msg):
-    proc.kill()
+    if isinstance(proc, subprocess.Popen):
+        reapProcessGroup(proc)
+    else:
+        proc.kill()
     utest.assertTrue(False, wrap(msg, 65))
 
 # Series of exception classes that allow raising runtime exceptions
@@ -115,20 +1269,82 @@ class MakefileError(Exception):
     def __init__(self, proc, utest, msg):
         kill_fail(proc, utest, msg)
 
+class RuntimeOutputTooLarge(Exception):
+    def __init__(self, proc, utest, msg):
+        kill_fail(proc, utest, msg)
+
+class RuntimeCPULimit(Exception):
+    def __init__(self, proc, utest, msg):
+        kill_fail(proc, utest, msg)
+
+class RuntimeFileSizeLimit(Exception):
+    def __init__(self, proc, utest, msg):
+        kill_fail(proc, utest, msg)
+
+class RuntimeMemoryLimit(Exception):
+    def __init__(self, proc, utest, msg):
+        kill_fail(proc, utest, msg)
+
+# Formats a number of bytes for limit messages (like "64 MiB")
+def formatBytes(size):
+    for unit in ('bytes', 'KiB', 'MiB'):
+        if size < 1024:
+            return '%g %s' % (size, unit)
+        size /= 1024
+    return '%g GiB' % size
+
+# Commands that run the student's program for it, and report a signal that stopped it as 128 + the signal number
+wrapperCommands = ['make', 'sh', 'bash', 'dash']
+
+# Determines whether a process ran the student's program directly: a ProgramRun whose command line is a list that
+# doesn't start with `make` or a shell (see makeTargetCommand)
+# Anything else (a `subprocess.Popen` made by a test, which may use `shell=True`, a command string, or an unknown
+# command line) may have gone through a shell or `make`
+def ranDirectly(proc):
+    args = getattr(proc, 'args', None)
+    if not isinstance(proc, ProgramRun) or not args or isinstance(args, (str, bytes)):
+        return False
+    return os.path.basename(os.fsdecode(args[0])) not in wrapperCommands
+
+# Gets the signal that stopped a process, or None if it exited on its own
+# Programs run directly report a signal as a negative return code. `make` exits with status 2 when its recipe
+# fails, and shells exit with 128 + the signal number, so every other process keeps the old mapping of the return
+# code modulo 128 (where 2 means a makefile error, see checkRuntimeErrors)
+def runtimeSignal(proc):
+    if not ranDirectly(proc):
+        return abs(proc.returncode) % 128
+    if proc.returncode < 0:
+        return -proc.returncode
+    return None
+
 # Function to check subprocess process for common runtime error signals
 # Raises exceptions with custom messages for test failures
+# Processes a run left running in the background are reported in the output of the test that checks it
+# A program run directly (see makeTargetCommand) can exit with any status it likes, so only the signal that
+# stopped it counts as a runtime error
 def checkRuntimeErrors(proc, utest, stdout, stderr):
-    if ((abs(proc.returncode) % 128) == int(signal.SIGABRT)):
+    if getattr(proc, 'leftoverProcesses', 0):
+        print(wrap(leftoverProcessesMessage.format(proc.leftoverProcesses), 65), file=sys.stderr)
+    runSignal = runtimeSignal(proc)
+    if getattr(proc, 'outputTooLarge', False):
+        raise RuntimeOutputTooLarge(proc, utest, outputTooLargeErrorMessage)
+    elif getattr(proc, 'limitExceeded', None) == 'cpu':
+        raise RuntimeCPULimit(proc, utest, cpuLimitErrorMessage.format(proc.limits['cpu']))
+    elif getattr(proc, 'limitExceeded', None) == 'fileSize':
+        raise RuntimeFileSizeLimit(proc, utest, fileSizeLimitErrorMessage.format(formatBytes(proc.limits['fileSize'])))
+    elif getattr(proc, 'limitExceeded', None) == 'memory':
+        raise RuntimeMemoryLimit(proc, utest, memoryLimitErrorMessage.format(formatBytes(proc.limits['memory']) if 'memory' in proc.limits else 'set by the system'))
+    elif runSignal == int(signal.SIGABRT):
         raise RuntimeAbort(proc, utest, 'Your program triggered runtime error SIGABRT. Check for compilation warnings, use GDB to track down the cause of this error, or Google this error for more information.')
-    elif ((abs(proc.returncode) % 128) == int(signal.SIGSEGV)):
+    elif runSignal == int(signal.SIGSEGV):
         raise RuntimeSegFault(proc, utest, 'Your program encountered a segmentation fault. Check for compilation warnings, use GDB to track down the cause of this error, or Google this error for more information.')
-    elif ((abs(proc.returncode) % 128) == int(signal.SIGFPE)):
+    elif runSignal == int(signal.SIGFPE):
         raise RuntimeFPE(proc, utest, 'Your program triggered runtime error SIGFPE (typically caused by dividing by zero). Check for compilation warnings, use GDB to track down the cause of this error, or Google this error for more information.')
-    elif ((abs(proc.returncode) % 128) == int(signal.SIGBUS)):
+    elif runSignal == int(signal.SIGBUS):
         raise RuntimeBusError(proc, utest, 'Your program triggered runtime error SIGBUS. Check for compilation warnings, use GDB to track down the cause of this error, or Google this error for more information.')
-    elif ((abs(proc.returncode) % 128) == int(signal.SIGILL)):
+    elif runSignal == int(signal.SIGILL):
         raise RuntimeIllegalInstruction(proc, utest, 'Your program triggered runtime error SIGILL (typically caused by stack smashing). Check for compilation warnings, use GDB to track down the cause of this error, or Google this error for more information.')
-    elif ((abs(proc.returncode) % 128) == int(signal.SIGINT)):
+    elif runSignal == int(signal.SIGINT) and not ranDirectly(proc):
         raise MakefileError(proc, utest, stderr.strip().decode('utf-8'))
 
 # Function to wrap strings for cleaner output in Gradescope
@@ -158,18 +1374,168 @@ def formatMessage(self, msg, standardMsg):
     except UnicodeDecodeError:
         return '%s:%s' % (safe_repr(standardMsg), safe_repr(msg))
 
+# Settings for the diffs shown by customAssertMultiLineEqual
+# Number of differing hunks shown before the rest are summarized
+diffMaxHunks = 5
+# Number of matching lines shown around each hunk
+diffContextLines = 3
+# Number of lines shown from each side of a single hunk
+diffMaxHunkLines = 50
+# Largest edit distance (in lines) searched for; beyond it, everything between the common prefix and suffix
+# is shown as one changed hunk, so the cost of a diff stays linear in the size of the output
+diffMaxEdits = 1000
+# Hunks with at most this many lines on each side get ndiff's intraline `?` hints
+diffMaxHintLines = 40
+
+# Linear-space Myers diff of a[aLo:aHi] and b[bLo:bHi], recursing on the middle snake
+# Adds the indices of lines only in `a` to `deleted` and of lines only in `b` to `inserted`
+# Returns False (without finishing) if the edit distance is more than `maxEdits`
+def myersDiff(a, aLo, aHi, b, bLo, bHi, deleted, inserted, maxEdits=None):
+    N, M = aHi - aLo, bHi - bLo
+    if N == 0 or M == 0:
+        deleted.update(range(aLo, aHi))
+        inserted.update(range(bLo, bHi))
+        return True
+
+    total = N + M
+    size = 2 * min(N, M) + 2
+    delta = N - M
+    forward, backward = [0] * size, [0] * size
+    for h in range(total // 2 + (total % 2 != 0) + 1):
+        if maxEdits is not None and 2 * h - 1 > maxEdits:
+            return False
+        for isForward in (True, False):
+            current, other = (forward, backward) if isForward else (backward, forward)
+            for k in range(-(h - 2 * max(0, h - M)), h - 2 * max(0, h - N) + 1, 2):
+                if k == -h or (k != h and current[(k - 1) % size] < current[(k + 1) % size]):
+                    x = current[(k + 1) % size]
+                else:
+                    x = current[(k - 1) % size] + 1
+                y = x - k
+                startX, startY = x, y
+                if isForward:
+                    while x < N and y < M and a[aLo + x] == b[bLo + y]:
+                        x, y = x + 1, y + 1
+                else:
+                    while x < N and y < M and a[aHi - 1 - x] == b[bHi - 1 - y]:
+                        x, y = x + 1, y + 1
+                current[k % size] = x
+                z = delta - k
+                odd = 1 if isForward else 0
+                if total % 2 == odd and -(h - odd) <= z <= h - odd and current[k % size] + other[z % size] >= N:
+                    if isForward:
+                        edits, x1, y1, x2, y2 = 2 * h - 1, startX, startY, x, y
+                    else:
+                        edits, x1, y1, x2, y2 = 2 * h, N - x, M - y, N - startX, M - startY
+                    if edits > 1 or (x1 != x2 and y1 != y2):
+                        return (myersDiff(a, aLo, aLo + x1, b, bLo, bLo + y1, deleted, inserted) and
+                                myersDiff(a, aLo + x2, aHi, b, bLo + y2, bHi, deleted, inserted))
+                    # At most one edit: the shorter side is a prefix of the longer one
+                    deleted.update(range(aLo + M, aHi))
+                    inserted.update(range(bLo + N, bHi))
+                    return True
+    return True
+
+# Returns difflib-style opcodes [(tag, i1, i2, j1, j2)] turning the lines `a` into the lines `b`
+# The common prefix and suffix are skipped in linear time before the Myers diff runs on what is left
+def lineDiffOpcodes(a, b, maxEdits=diffMaxEdits):
+    # Compare small integers instead of strings
+    ids = {}
+    a = [ids.setdefault(line, len(ids)) for line in a]
+    b = [ids.setdefault(line, len(ids)) for line in b]
+
+    prefix = 0
+    while prefix < len(a) and prefix < len(b) and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < len(a) - prefix and suffix < len(b) - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+
+    aHi, bHi = len(a) - suffix, len(b) - suffix
+    deleted, inserted = set(), set()
+    if not myersDiff(a, prefix, aHi, b, prefix, bHi, deleted, inserted, maxEdits):
+        # Too different to be worth aligning: one hunk for everything in between
+        deleted, inserted = set(range(prefix, aHi)), set(range(prefix, bHi))
+
+    opcodes = []
+    i = j = 0
+    while i < len(a) or j < len(b):
+        if i in deleted or j in inserted:
+            i1, j1 = i, j
+            while i in deleted:
+                i += 1
+            while j in inserted:
+                j += 1
+            tag = 'replace' if i > i1 and j > j1 else ('delete' if i > i1 else 'insert')
+        else:
+            i1, j1 = i, j
+            while i < len(a) and j < len(b) and i not in deleted and j not in inserted:
+                i, j = i + 1, j + 1
+            tag = 'equal'
+        opcodes.append((tag, i1, i, j1, j))
+    return opcodes
+
+# Groups opcodes into hunks with `context` matching lines around each change
+def groupOpcodes(opcodes, context=diffContextLines):
+    hunks = []
+    hunk = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            if hunk and i2 - i1 > 2 * context:
+                hunk.append((tag, i1, i1 + context, j1, j1 + context))
+                hunks.append(hunk)
+                hunk = []
+            if not hunk:
+                start = max(i1, i2 - context)
+                hunk.append((tag, start, i2, j1 + start - i1, j2))
+            else:
+                hunk.append((tag, i1, i2, j1, j2))
+        else:
+            hunk.append((tag, i1, i2, j1, j2))
+    if hunk and any(tag != 'equal' for tag, i1, i2, j1, j2 in hunk):
+        hunks.append(hunk)
+    return hunks
+
+# Lines shown for one side of a change, cut off after `diffMaxHunkLines`
+def diffSideLines(prefix, lines):
+    shown = [prefix + line for line in lines[:diffMaxHunkLines]]
+    if len(lines) > diffMaxHunkLines:
+        shown.append('{}... ({} more lines)\n'.format(prefix, len(lines) - diffMaxHunkLines))
+    return shown
+
+# Builds an ndiff-style report ('- ' for lines only in `first`, '+ ' for lines only in `second`) showing at
+# most `maxHunks` hunks with `context` matching lines around each
+def formatLineDiff(first, second, maxHunks=diffMaxHunks, context=diffContextLines):
+    hunks = groupOpcodes(lineDiffOpcodes(first, second), context)
+    shown = hunks[:maxHunks]
+    wholeDiff = len(hunks) == 1 and shown[0][0][1] == 0 and shown[0][0][3] == 0 and shown[0][-1][2] == len(first) and shown[0][-1][4] == len(second)
+
+    lines = []
+    for hunk in shown:
+        if not wholeDiff:
+            lines.append('@@ Line {} of your output, line {} of the expected output @@\n'.format(hunk[0][1] + 1, hunk[0][3] + 1))
+        for tag, i1, i2, j1, j2 in hunk:
+            if tag == 'equal':
+                lines.extend('  ' + line for line in first[i1:i2])
+            elif tag == 'replace' and i2 - i1 <= diffMaxHintLines and j2 - j1 <= diffMaxHintLines:
+                lines.extend(difflib.ndiff(first[i1:i2], second[j1:j2]))
+            else:
+                lines.extend(diffSideLines('- ', first[i1:i2]))
+                lines.extend(diffSideLines('+ ', second[j1:j2]))
+    if len(hunks) > maxHunks:
+        lines.append('@@ {} more difference(s) not shown @@\n'.format(len(hunks) - maxHunks))
+    return ''.join(line if line.endswith('\n') else line + '\n' for line in lines)
+
 # Custom version of unittest assertMultiLineEqual tailored to make
 # diff checks more readable
+# Uses a linear-space diff (see formatLineDiff), so long outputs get a bounded-cost diff too
+@tracing.traced()
 def customAssertMultiLineEqual(self, first, second, msg=None):
     """(Custom) Assert that two multi-line strings are equal."""
     self.assertIsInstance(first, str, 'First argument is not a string')
     self.assertIsInstance(second, str, 'Second argument is not a string')
 
     if first != second:
-        # don't use difflib if the strings are too long
-        if (len(first) > self._diffThreshold or
-            len(second) > self._diffThreshold):
-            self._baseAssertEqual(first, second, msg)
         firstlines = first.splitlines(keepends=True)
         secondlines = second.splitlines(keepends=True)
         if len(firstlines) == 1 and first.strip('\r\n') == first:
@@ -177,7 +1543,7 @@ def customAssertMultiLineEqual(self, first, second, msg=None):
             secondlines = [second + '\n']
         # standardMsg = '%s != %s' % _common_shorten_repr(first, second)
         standardMsg = ''
-        diff = '\n' + ''.join(difflib.ndiff(firstlines, secondlines))
+        diff = '\n' + formatLineDiff(firstlines, secondlines)
         standardMsg = self._truncateMessage(standardMsg, diff)
         self.fail(formatMessage(self, standardMsg, msg).rstrip('\n'))
         
@@ -187,8 +1553,392 @@ class UninitializedCharError(Exception):
         
 # Function that checks for uninitialized characters in program output
 # This should check for '\u0000', which is not caught by UnicodeDecodeError
+@tracing.traced()
 def checkForUninitializedChars(str):
     if '\u0000' in str:
         raise UninitializedCharError
     else:
-        return str
\ No newline at end of file
+        return str
+
+# Custom exception for program output that cannot be read as a PPM image
+class PPMFormatError(Exception):
+    pass
+
+# A parsed PPM image: the header values, plus the raw color values as one flat buffer of bytes
+# (3 values per pixel, pixels row by row, each value `sampleSize` bytes long in `byteorder`)
+# For binary (P6) images, `samples` is a view of the program output itself, so pixel data is never copied
+class PPMImage(object):
+    def __init__(self, magic, width, height, maxval, samples, sampleSize, byteorder):
+        self.magic = magic
+        self.width = width
+        self.height = height
+        self.maxval = maxval
+        self.samples = samples
+        self.sampleSize = sampleSize
+        self.byteorder = byteorder
+
+    # Gets the color value at an index of the flat array of values
+    def value(self, index):
+        return int.from_bytes(self.samples[index * self.sampleSize:(index + 1) * self.sampleSize], self.byteorder)
+
+# Matches the next token of a PPM image, skipping whitespace and comments (from `#` to the end of the line)
+ppmTokenPattern = re.compile(rb'(?:\s+|#[^\r\n]*)*([^\s#]+)')
+
+# Plain (P3) color values are parsed in chunks of about this many bytes, so memory use doesn't depend on the image size
+ppmChunkSize = 1024 * 1024
+
+# Names of the color channels of a pixel, used in mismatch messages
+ppmChannelNames = ('red', 'green', 'blue')
+
+# Reads the tokens of a PPM image one at a time, starting at `pos`
+# Yields every token with the position right after it, and stops at the end of the data
+# Nothing past the last token requested is looked at, so reading a header doesn't scan the pixels
+def iterPPMTokens(data, pos=0):
+    while True:
+        match = ppmTokenPattern.match(data, pos)
+        if match is None:
+            return
+        pos = match.end()
+        yield match.group(1), pos
+
+# Gets (at most) the first `count` tokens of a PPM image: the header label, width, height and maximum pixel value
+def readPPMHeaderTokens(data, count=4):
+    return [token for token, pos in islice(iterPPMTokens(data), count)]
+
+# Gets the output budget (see maxOutputBytes) for a program that prints an image like the PPM file `referencePath`
+# Sized for the image as plain P3 text (its largest form, with a few separators per value), so multi-megapixel
+# images are never stopped as too much output; never less than maxOutputBytes
+def ppmOutputBudget(referencePath):
+    with open(referencePath, 'rb') as file:
+        header = readPPMHeaderTokens(file.read(4096))
+    try:
+        width, height, maxval = (int(token) for token in header[1:4])
+    except ValueError:
+        return maxOutputBytes
+    return max(maxOutputBytes, width * height * 3 * (len(str(maxval)) + 3) + 4096)
+
+# Gets the largest color value in a buffer of `sampleSize`-byte values
+def highestPPMValue(samples, sampleSize, byteorder):
+    if numpy is not None:
+        return int(numpy.frombuffer(samples, numpy.dtype(numpy.uint8 if sampleSize == 1 else ('>u2' if byteorder == 'big' else '<u2'))).max(initial=0))
+    if sampleSize == 1:
+        return max(samples, default=0)
+    return max((int.from_bytes(samples[index:index + 2], byteorder) for index in range(0, len(samples), 2)), default=0)
+
+# Parses the color values of a plain (P3) image, starting at `pos`, into an array of `typecode` integers
+# The values are split one chunk at a time (chunks end at whitespace, or at a line break if the image has comments)
+def readPPMValues(data, pos, typecode):
+    values = array(typecode)
+    boundary = re.compile(rb'[\r\n]' if data.find(b'#', pos) != -1 else rb'\s')
+    while pos < len(data):
+        match = boundary.search(data, min(pos + ppmChunkSize, len(data)))
+        end = match.end() if match else len(data)
+        chunk = data[pos:end]
+        if b'#' in chunk:
+            chunk = re.sub(rb'#[^\r\n]*', b' ', chunk)
+        values.extend(map(int, chunk.split()))
+        pos = end
+    return values
+
+# Parses a plain (P3) or binary (P6) PPM image from program output
+# Plain color values are read as whitespace-separated numbers, so it doesn't matter how the program wraps them into lines
+# Raises PPMFormatError with a message for the student if the output is not a valid image
+@tracing.traced()
+def readPPM(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    header = list(islice(iterPPMTokens(data), 4))
+
+    if len(header) < 4:
+        raise PPMFormatError('Your PPM image\'s header is too short, and cannot be used in autograder comparisons. Ensure your program prints the correct header information.')
+    magic = header[0][0].decode('utf-8', 'replace')
+    if magic not in ('P3', 'P6'):
+        raise PPMFormatError(f'Your PPM image\'s header label is incorrect. Your header label: {magic}, expected header label: P3 or P6')
+    try:
+        width, height, maxval = (int(token) for token, pos in header[1:])
+    except ValueError:
+        raise PPMFormatError('Your PPM image\'s header contains a value that is not a number. Ensure your program prints the correct header information.')
+    if width < 0 or height < 0 or not 0 < maxval < 65536:
+        raise PPMFormatError(f'Your PPM image\'s header is invalid. Your width, height and maximum pixel value: {width} {height} {maxval}')
+
+    pos = header[3][1]
+    count = width * height * 3
+    sampleSize = 1 if maxval < 256 else 2
+
+    if magic == 'P6':
+        # Binary pixel data starts after the single whitespace character that ends the header
+        samples = memoryview(data)[pos + 1:]
+        if len(samples) != count * sampleSize or not data[pos:pos + 1].isspace():
+            raise PPMFormatError(f'Your PPM image contains {len(samples)} bytes of pixel data, but its header describes {count * sampleSize} ({width} x {height} pixels with 3 values of {sampleSize} byte(s) each).')
+        byteorder = 'big'
+    else:
+        try:
+            values = readPPMValues(data, pos, 'B' if sampleSize == 1 else 'H')
+        except ValueError:
+            raise PPMFormatError('Your PPM image contains a color value that is not a number. Ensure your program only prints numbers after the header.')
+        except OverflowError:
+            raise PPMFormatError(f'Your PPM image contains a color value outside of the range 0 to {maxval} (the maximum pixel value in its header).')
+        if len(values) != count:
+            raise PPMFormatError(f'Your PPM image contains {len(values)} color values, but its header describes {count} ({width} x {height} pixels with 3 values each).')
+        samples, byteorder = memoryview(values).cast('B'), sys.byteorder
+
+    # Values can only be out of range if the maximum pixel value is lower than the largest value that fits in a sample
+    if maxval < 256 ** sampleSize - 1 and highestPPMValue(samples, sampleSize, byteorder) > maxval:
+        raise PPMFormatError(f'Your PPM image contains a color value outside of the range 0 to {maxval} (the maximum pixel value in its header).')
+
+    return PPMImage(magic, width, height, maxval, samples, sampleSize, byteorder)
+
+# Parses a reference PPM image file; each file is only read and parsed once
+@lru_cache(maxsize=None)
+def readPPMFile(path):
+    with open(path, 'rb') as file:
+        return readPPM(file.read())
+
+# Result of a pixel by pixel comparison of two PPM images of the same size
+# `firstDifference` is (x, y, channel) and `boundingBox` is (left, top, right, bottom), inclusive
+class PPMComparison(object):
+    def __init__(self, differingPixels, firstDifference, boundingBox):
+        self.differingPixels = differingPixels
+        self.firstDifference = firstDifference
+        self.boundingBox = boundingBox
+
+# Compares the pixels of two PPM images with the same format, width, height and maximum pixel value
+# Returns None if every pixel matches, and a PPMComparison otherwise
+# Whole rows are compared at once, so only rows that differ are looked at value by value
+@tracing.traced()
+def comparePPM(image, reference):
+    width, height, sampleSize = reference.width, reference.height, reference.sampleSize
+
+    if numpy is not None:
+        dtype = numpy.uint8 if sampleSize == 1 else numpy.uint16
+        channels = numpy.frombuffer(image.samples, dtype).reshape(height, width, 3) != numpy.frombuffer(reference.samples, dtype).reshape(height, width, 3)
+        if not channels.any():
+            return None
+        pixels = channels.any(axis=2)
+        y, x, channel = (int(value) for value in numpy.unravel_index(numpy.argmax(channels), channels.shape))
+        rows = numpy.flatnonzero(pixels.any(axis=1))
+        columns = numpy.flatnonzero(pixels.any(axis=0))
+        return PPMComparison(int(pixels.sum()), (x, y, channel), (int(columns[0]), int(rows[0]), int(columns[-1]), int(rows[-1])))
+
+    rowLength = width * 3 * sampleSize
+    differingPixels, firstDifference = 0, None
+    left, top, right, bottom = width, height, -1, -1
+    for y in range(height):
+        start = y * rowLength
+        # Rows are copied to bytes (one at a time) because comparing bytes is much faster than comparing memoryviews
+        row = bytes(image.samples[start:start + rowLength])
+        referenceRow = bytes(reference.samples[start:start + rowLength])
+        if row == referenceRow:
+            continue
+        columns = sorted(set(index // (3 * sampleSize) for index, (value, expected) in enumerate(zip(row, referenceRow)) if value != expected))
+        if firstDifference is None:
+            x = columns[0]
+            channel = next(channel for channel in range(3) if image.value((y * width + x) * 3 + channel) != reference.value((y * width + x) * 3 + channel))
+            firstDifference = (x, y, channel)
+        differingPixels += len(columns)
+        left, right = min(left, columns[0]), max(right, columns[-1])
+        top, bottom = min(top, y), y
+    if firstDifference is None:
+        return None
+    return PPMComparison(differingPixels, firstDifference, (left, top, right, bottom))
+
+# Builds the message shown to the student for a failed PPM comparison
+def formatPPMComparison(image, reference, comparison):
+    x, y, channel = comparison.firstDifference
+    index = (y * reference.width + x) * 3 + channel
+    left, top, right, bottom = comparison.boundingBox
+    return (f'Your PPM image does not match the expected image: {comparison.differingPixels} of {reference.width * reference.height} pixels are different. '
+            f'The first difference is at pixel (x={x}, y={y}), {ppmChannelNames[channel]} value: your value {image.value(index)}, expected value {reference.value(index)}. '
+            f'Every different pixel is within the area from (x={left}, y={top}) to (x={right}, y={bottom}).')
+
+# Checks a PPM image printed by the student's program against a reference image file, pixel by pixel
+# Fails the test with the number of different pixels, the first difference and the area that differs
+def assertPPMEqual(utest, output, referencePath):
+    reference = readPPMFile(referencePath)
+    try:
+        image = readPPM(output)
+    except PPMFormatError as error:
+        utest.assertTrue(False, wrap(str(error), 65))
+        return
+
+    if image.magic != reference.magic:
+        utest.assertTrue(False, wrap(f'Your PPM image\'s header label is incorrect. Your header label: {image.magic}, expected header label: {reference.magic}', 65))
+    if (image.width, image.height, image.maxval) != (reference.width, reference.height, reference.maxval):
+        utest.assertTrue(False, wrap(f'Your PPM image\'s size or maximum pixel value is incorrect. Your width, height and maximum pixel value: {image.width} {image.height} {image.maxval}, expected: {reference.width} {reference.height} {reference.maxval}', 65))
+
+    comparison = comparePPM(image, reference)
+    if comparison is not None:
+        utest.assertTrue(False, wrap(formatPPMComparison(image, reference, comparison), 65))
+
+# Compares one stream (`test.stream`) of a run with the test's reference file, ignoring empty lines
+# If the program was stopped at its first wrong line, only compares up to that line
+def compareOutput(utest, run, test):
+    output = checkForUninitializedChars(getattr(run, test.stream).strip().decode('utf-8'))
+    reference = open(test.reference, 'rb').read().strip().decode('utf-8')
+    output = limitToDivergence(removeEmptyLines(output), run)
+    reference = limitToDivergence(removeEmptyLines(reference), run)
+    customAssertMultiLineEqual(utest, output, reference, msg='Program output does not match expected output')
+
+# Compares stderr with `test.reference['stderr']` if the program only printed to stderr,
+# and stdout with `test.reference['stdout']` otherwise
+def compareStdoutOrStderr(utest, run, test):
+    stdout = removeEmptyLines(checkForUninitializedChars(run.stdout.strip().decode('utf-8')))
+    stderr = removeEmptyLines(checkForUninitializedChars(run.stderr.strip().decode('utf-8')))
+    stream, output = ('stderr', stderr) if not stdout and stderr else ('stdout', stdout)
+    reference = removeEmptyLines(open(test.reference[stream], 'rb').read().strip().decode('utf-8'))
+    customAssertMultiLineEqual(utest, output, reference, msg='Program output does not match expected output')
+
+# One row of a declarative table of output tests (see outputTests)
+# The test runs `make -s <target>` (resolved with makeTargetCommand) with the file `stdin` as stdin, then checks the
+# run with `comparator(utest, run, test)`; by default, `stream` ('stdout' or 'stderr') is compared with `reference`
+# `name` is used for the test method (`test_<name>`) and `title` is the name shown on Gradescope
+class OutputTest(object):
+    def __init__(self, number, name, title, stdin=None, reference=None, stream='stdout', weight=15, target='run',
+                 timeout=10, comparator=compareOutput, visibility='visible'):
+        self.number = number
+        self.name = name
+        self.title = title
+        self.stdin = stdin
+        self.reference = reference
+        self.stream = stream
+        self.weight = weight
+        self.target = target
+        self.timeout = timeout
+        self.comparator = comparator
+        self.visibility = visibility
+
+# Number of planned runs started at once when an execution plan is dispatched (None = one per available core)
+# Set it higher for assignments whose programs mostly wait (on `sleep` or input), so more of them overlap
+planJobs = None
+
+# Every distinct run of the student's program needed by a table of output tests
+# Tests with the same target and stdin share one run. A run needed by a single test compares its output with the
+# reference while the program runs (see StreamingComparison), since no other test needs the rest of its output
+# When tests run one at a time, the setUp of the first test of the plan dispatches every run in the plan on an
+# asyncio event loop (see runProgramsConcurrently), up to planJobs at a time, each with its own time limit, and every
+# test then just checks its result. Dispatching in setUp keeps the runs out of that test's own `@timeout` (the compile test in the
+# same class has to run first, so setUpClass is too early)
+# The plan is only dispatched once the executables the tests need exist (see executablesBuilt), so its runs never
+# compile the program themselves (a `make -s <target>` run would build a missing executable, or rebuild it again and
+# again if the compile failed), and a test that sorts before the compile test doesn't build the program for it
+# Tests that run in forked workers (`run_tests.py --jobs N`) are already concurrent, so they only run their own run
+# (identical runs in other workers still share one result through the run cache)
+class ExecutionPlan(object):
+    def __init__(self, tests):
+        groups = {}
+        for test in tests:
+            groups.setdefault((test.target, test.stdin), []).append(test)
+
+        # Run key of every test: (target, stdin, compareWith, compareStream)
+        self.runs = {}
+        # Longest time limit of the tests that share each run
+        self.timeouts = {}
+        for (target, stdin), group in groups.items():
+            for test in group:
+                streamed = len(group) == 1 and test.comparator is compareOutput and isinstance(test.reference, str)
+                key = (target, stdin, test.reference, test.stream) if streamed else (target, stdin, None, 'stdout')
+                self.runs[test.name] = key
+                self.timeouts[key] = max(self.timeouts.get(key, 0), test.timeout)
+
+        # Result of every run (a ProgramRun, or the exception it raised), filled in by dispatch
+        self.results = {}
+        self.dispatched = False
+        self.lock = threading.Lock()
+
+    # Builds the runProgram arguments of a run
+    def runArguments(self, utest, key):
+        target, stdin, compareWith, compareStream = key
+        executables = builtExecutables if utest.executables is None else utest.executables
+        return {'args': makeTargetCommand(target, executables), 'stdin': stdin, 'executables': executables,
+                'compareWith': compareWith, 'compareStream': compareStream}
+
+    # Runs every distinct run in the plan (up to planJobs at a time), each under the time limit of the tests that need it
+    # Runs that time out store the timeout exception, and every test that needs them raises a copy of it
+    @tracing.traced('dispatch execution plan')
+    def dispatch(self, utest):
+        keys = list(dict.fromkeys(self.runs.values()))
+        recorded = len(programRuns)
+        runs = [dict(self.runArguments(utest, key), seconds=self.timeouts[key]) for key in keys]
+        self.results = dict(zip(keys, runProgramsConcurrently(runs, planJobs)))
+        # Each test records the run it uses instead (see run)
+        del programRuns[recorded:]
+        self.dispatched = True
+
+    # Dispatches the plan before the first of its tests runs (called from the setUp of every test in the class)
+    # Nothing is dispatched until the executables exist; each test then fails checkExecutables on its own
+    # Tests in forked workers run their own run instead (see run)
+    def prepare(self, utest):
+        if utest._testMethodName[len('test_'):] not in self.runs or multiprocessing.parent_process() is not None:
+            return
+        if not executablesBuilt(utest.executables):
+            return
+        with self.lock:
+            if not self.dispatched:
+                self.dispatch(utest)
+
+    # Gets the run needed by one test of the plan
+    # A stored exception is copied, so each test raises (and adds its traceback to) its own instance
+    def run(self, utest, test):
+        key = self.runs[test.name]
+        arguments = self.runArguments(utest, key)
+        if multiprocessing.parent_process() is not None:
+            return runProgram(**arguments)
+
+        self.prepare(utest)
+        result = self.results[key]
+        if isinstance(result, BaseException):
+            raise shallowCopy(result)
+        recordProgramRun(arguments['args'], result)
+        return result
+
+# Builds the test method for one row of a table of output tests, with the same steps (and decorators) as
+# a hand-written output test: check the executables, get the run, check for runtime errors, then compare
+def outputTestMethod(test):
+    def method(self):
+        checkExecutables(self, self.executables)
+        run = self.executionPlan.run(self, test)
+        stdout, stderr = run.stdout, run.stderr
+
+        try:
+            checkRuntimeErrors(run, self, stdout, stderr)
+
+            try:
+                test.comparator(self, run, test)
+
+            # Catch exception for decode error
+            except (UnicodeDecodeError):
+                kill_fail(run, self, decodeErrorMessage)
+
+            # Catch exception for uninitialized characters
+            except (UninitializedCharError):
+                kill_fail(run, self, uninitializedCharacterMessage)
+
+        # Catch runtime error exceptions
+        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError, RuntimeOutputTooLarge,
+                RuntimeCPULimit, RuntimeFileSizeLimit, RuntimeMemoryLimit):
+            pass
+
+    method.__name__ = 'test_' + test.name
+    method.__doc__ = test.title
+    method = decorators.weight(test.weight)(method)
+    method = timeout.timeout(test.timeout, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False, use_watchdog=True)(method)
+    method = parallel()(method)
+    method = decorators.visibility(test.visibility)(method)
+    return decorators.number(test.number)(method)
+
+# Class decorator that adds a test method for every OutputTest in `tests`, and the execution plan they share
+# The class's setUp is extended to dispatch the plan before the first of these tests (see ExecutionPlan)
+# The class needs an `executables` attribute, like the sample TestDiff classes
+# Usage: @outputTests(outputTable)
+def outputTests(tests):
+    def decorate(cls):
+        cls.executionPlan = ExecutionPlan(tests)
+        classSetUp = cls.setUp
+        def setUp(self):
+            classSetUp(self)
+            self.executionPlan.prepare(self)
+        cls.setUp = setUp
+        for test in tests:
+            setattr(cls, 'test_' + test.name, outputTestMethod(test))
+        return cls
+    return decorate
@@ -3,13 +3,9 @@ import unittest
 import timeout
 # Requires gradescope_utils
 from gradescope_utils.autograder_utils.decorators import number, weight, visibility
-import subprocess
 from time import sleep
-from re import sub
 # utils.py
 from utils import *
-from pathlib import Path
-import os
 
 # Main unit test class
 class TestDiff(unittest.TestCase):
@@ -52,9 +48,10 @@ class TestDiff(unittest.TestCase):
 
         checkSourceFiles(self, self.files)
 
-        # Create a subprocess to run the student's Makefile to ensure it compiles
-        test = subprocess.Popen(["make"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
+        # Run the student's Makefile to ensure it compiles (in its own session, so make and everything it started
+        # are stopped with it), or restore the executables and compiler output of an identical earlier compile
+        test = compileProgram(self.executables)
+        stdout, stderr = test.stdout, test.stderr
         
         # Try to decode stderr
         try:
@@ -74,7 +71,7 @@ class TestDiff(unittest.TestCase):
     # Test visibility
     @visibility("visible")
     # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
+    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False, use_watchdog=True)
     # Associated point value within Gradescope
     @weight(30)
     def test_FileExistsWithoutProgramRun(self):
@@ -82,7 +79,7 @@ class TestDiff(unittest.TestCase):
         """Check that "test1.txt" file exists"""
         
         file = "test1.txt"
-        if Path(file).is_file():
+        if workingFile(file) is not None:
             self.assertTrue(True)
         else:
             self.assertTrue(False, wrap("\"" + file + "\" does not exist.", 65))
@@ -92,7 +89,7 @@ class TestDiff(unittest.TestCase):
     # Test visibility
     @visibility("visible")
     # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
+    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False, use_watchdog=True)
     # Associated point value within Gradescope
     @weight(30)
     def test_IsExecutable(self):
@@ -100,8 +97,9 @@ class TestDiff(unittest.TestCase):
         """Check that "main.out" executable exists"""
         
         file = "main.out"
-        if Path(file).is_file():
-            if os.access(Path(file), os.X_OK):
+        entry = workingFile(file)
+        if entry is not None:
+            if entry.isExecutable():
                 self.assertTrue(True)
             else:
                 self.assertTrue(False, wrap("\"" + file + "\" is not an executable.", 65))
@@ -113,7 +111,7 @@ class TestDiff(unittest.TestCase):
     # Test visibility
     @visibility("visible")
     # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
+    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False, use_watchdog=True)
     # Associated point value within Gradescope
     @weight(30)
     def test_FileExistsWithProgramRun(self):
@@ -122,21 +120,22 @@ class TestDiff(unittest.TestCase):
         
         checkExecutables(self, self.executables)
         
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["./main.out"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
+        # Run the student's code to obtain an output (this test relies on the file the program creates,
+        # so the run is never reused from the run cache)
+        test = runProgram(['./main.out'], executables=self.executables, cache=False)
+        stdout, stderr = test.stdout, test.stderr
         
         try:
             checkRuntimeErrors(test, self, stdout, stderr)
             
             file = "test2.txt"
-            if Path(file).is_file():
+            if workingFile(file) is not None:
                 self.assertTrue(True)
             else:
                 self.assertTrue(False, wrap("\"" + file + "\" does not exist.", 65))
         
         # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
+        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError, RuntimeOutputTooLarge):
             pass
         
         test.terminate()
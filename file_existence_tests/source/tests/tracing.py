@@ -0,0 +1,145 @@
+# Opt-in tracing of the phases of every test (checking files, compiling, starting and running the student's program,
+# normalizing and comparing output, waiting on `timeout` processes, ...)
+# Spans are written as a Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev), with a table of the
+# slowest phases printed to stderr
+# Tracing is turned on by `run_tests.py --trace FILE`, which sets the AUTOGRADER_TRACE environment variable before
+# the tests are imported. When it is off, `traced` returns functions unchanged and `span` returns a shared
+# context manager that does nothing, so the tests run as if this module didn't exist
+import os
+import sys
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+# Path of the trace file, or None if tracing is off
+traceFile = os.environ.get('AUTOGRADER_TRACE') or None
+enabled = traceFile is not None
+
+# Name of the test running in this process (set by the test runner), added to every span
+currentTest = None
+
+# Number of phases shown in the summary table
+summaryLength = 15
+
+# Spans recorded by this process that haven't been written to the parts file yet
+_spans = []
+_lock = threading.Lock()
+_noSpan = nullcontext()
+
+# Forked processes (test workers, `timeout` children) start without the spans of the process they were forked from
+# The lock is held across the fork, so a process forked by one thread while another records a span gets it unlocked
+def _afterForkInChild():
+    _spans.clear()
+    _lock.release()
+
+os.register_at_fork(before=_lock.acquire, after_in_parent=_lock.release, after_in_child=_afterForkInChild)
+
+# Spans of every process are appended to this file (one JSON object per line), then collected by writeTrace
+def partsFile():
+    return traceFile + '.parts'
+
+# Records a span from `start` to `end` (time.monotonic_ns() values, which are shared by every process)
+# Spans go on the lane of the current thread, unless another lane is given as `tid` (for spans that overlap on
+# one thread, like programs run at the same time on an asyncio event loop)
+def record(name, category, start, end, args=None, tid=None):
+    event = {'name': name, 'cat': category, 'ph': 'X', 'ts': start / 1000, 'dur': (end - start) / 1000,
+             'pid': os.getpid(), 'tid': tid or threading.get_native_id(), 'args': dict(args or {}, test=currentTest)}
+    with _lock:
+        _spans.append(event)
+
+@contextmanager
+def _span(name, category, args):
+    start = time.monotonic_ns()
+    try:
+        yield
+    finally:
+        record(name, category, start, time.monotonic_ns(), args)
+
+# Context manager that records the time spent in its block as a span called `name`
+def span(name, category='phase', **args):
+    if not enabled:
+        return _noSpan
+    return _span(name, category, args)
+
+# Decorator that records every call of a function as a span (named after the function, unless `name` is given)
+# Usage: @tracing.traced()
+def traced(name=None, category='phase'):
+    def decorate(function):
+        if not enabled:
+            return function
+        spanName = name or function.__name__
+
+        @wraps(function)
+        def new_function(*args, **kwargs):
+            with _span(spanName, category, None):
+                return function(*args, **kwargs)
+        return new_function
+    return decorate
+
+# Appends the spans recorded by this process to the parts file
+# Called after every test, and by `timeout` children before they exit
+def flush():
+    if not enabled:
+        return
+    with _lock:
+        data = ''.join(json.dumps(event) + '\n' for event in _spans).encode('utf-8')
+        _spans.clear()
+    if data:
+        # One write to a file opened for appending, so lines from different processes never interleave
+        fd = os.open(partsFile(), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+# Removes the spans left behind by an earlier run
+def reset():
+    if enabled:
+        with _lock:
+            _spans.clear()
+        try:
+            os.remove(partsFile())
+        except FileNotFoundError:
+            pass
+
+# Adds up the time spent in every phase: returns (name, calls, total ms, longest ms) rows, slowest first
+# Whole tests (category 'test') and the whole run (category 'runner') are left out
+def summarize(events):
+    phases = {}
+    for event in events:
+        if event['cat'] in ('test', 'runner'):
+            continue
+        calls, total, longest = phases.get(event['name'], (0, 0, 0))
+        phases[event['name']] = (calls + 1, total + event['dur'] / 1000, max(longest, event['dur'] / 1000))
+    return sorted(((name,) + phase for name, phase in phases.items()), key=lambda row: row[2], reverse=True)
+
+# Formats summary rows as a table
+def formatSummary(rows):
+    lines = ['Slowest phases (by total time):', '%-36s %7s %12s %12s' % ('phase', 'calls', 'total (ms)', 'max (ms)')]
+    for name, calls, total, longest in rows[:summaryLength]:
+        lines.append('%-36s %7d %12.2f %12.2f' % (name[:36], calls, total, longest))
+    return '\n'.join(lines)
+
+# Collects the spans of every process into the trace file, and prints the summary table to stderr
+# Called once by run_tests.py, after every test has run
+def writeTrace():
+    if not enabled:
+        return
+    flush()
+    events = []
+    try:
+        with open(partsFile()) as file:
+            events = [json.loads(line) for line in file if line.strip()]
+        os.remove(partsFile())
+    except FileNotFoundError:
+        pass
+    events.sort(key=lambda event: event['ts'])
+
+    rows = summarize(events)
+    with open(traceFile, 'w') as file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                   'summary': [{'phase': name, 'calls': calls, 'total_ms': round(total, 3), 'max_ms': round(longest, 3)}
+                               for name, calls, total, longest in rows]}, file)
+    print(formatSummary(rows), file=sys.stderr)
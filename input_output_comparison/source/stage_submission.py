@@ -0,0 +1,242 @@
+# Copies the student's submission into the autograder's working directory (`source/`) in a single pass
+# Is run by `run_autograder` before the tests. Walks the submission once (with os.scandir), keeps the files whose
+# names match the include patterns (and none of the exclude patterns), and extracts the matching files of any
+# archive the student uploaded (`.zip`, `.tar`, `.tar.gz`, ...), within size and entry-count limits
+# Files are hard-linked into place when possible, and copied with os.copy_file_range otherwise, so no process is
+# started per file
+#
+# Usage (as in run_autograder):
+#   python3 stage_submission.py /autograder/submission /autograder/source [--include '*.c' ...] [--exclude PATTERN ...]
+import argparse
+import fnmatch
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import zipfile
+
+# Names of the files that are staged (like `find -name`); every other file is left out
+defaultIncludePatterns = ['*.c', 'makefile', 'Makefile']
+
+# Names of archives that are extracted (their files are staged with the same patterns)
+archivePatterns = ['*.zip', '*.tar', '*.tar.gz', '*.tgz', '*.tar.bz2', '*.tbz2', '*.tar.xz', '*.txz']
+
+# Name of the file (in the destination) that lists every file inside the submission's archives, one path per line,
+# so `checkFiles` in utils.py counts files submitted in an archive as submitted (even the ones that aren't staged)
+archiveContentsName = '.archive_contents'
+
+# Limits on the files in the archives of one submission (so a zip bomb can't fill the disk); every file in an
+# archive counts towards the entry limit, and every extracted byte towards the size limit
+maxArchiveEntries = 10000
+maxArchiveBytes = 100 * 1024 * 1024
+
+# Raised when an archive is over the limits or can't be read
+class ArchiveError(Exception):
+    pass
+
+# Determines whether a file name matches any of a list of patterns
+def matches(name, patterns):
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+# Lists every file under a folder as (path relative to the folder, full path), in path order
+# Symbolic links to folders are not followed
+def walkFiles(root):
+    files = []
+    pending = ['']
+    while pending:
+        relative = pending.pop()
+        with os.scandir(os.path.join(root, relative)) as entries:
+            for entry in entries:
+                path = os.path.join(relative, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(path)
+                elif entry.is_file():
+                    files.append((path, entry.path))
+    return sorted(files)
+
+# Copies a file with os.copy_file_range (which lets the kernel copy the data, or share it on filesystems that
+# support it), falling back to shutil.copyfile where that isn't available
+def copyFileRange(source, destination):
+    if not hasattr(os, 'copy_file_range'):
+        shutil.copyfile(source, destination)
+        return
+    with open(source, 'rb') as sourceFile, open(destination, 'wb') as destinationFile:
+        remaining = os.fstat(sourceFile.fileno()).st_size
+        while remaining > 0:
+            try:
+                copied = os.copy_file_range(sourceFile.fileno(), destinationFile.fileno(), remaining)
+            except OSError:
+                # Not supported between these filesystems: copy the rest (both files are at the same offset)
+                shutil.copyfileobj(sourceFile, destinationFile)
+                return
+            if copied == 0:
+                break
+            remaining -= copied
+
+# Puts a file at `destination`, replacing whatever is there: hard-links it if `link` is set and the file is on
+# the same filesystem, and copies it otherwise
+def placeFile(source, destination, link=True):
+    os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+    # Already staged (renaming a hard link over the same file does nothing)
+    if link and os.path.exists(destination) and os.path.samefile(source, destination):
+        return
+    temp = destination + '.staging'
+    try:
+        os.remove(temp)
+    except FileNotFoundError:
+        pass
+    if link:
+        try:
+            os.link(source, temp)
+            os.replace(temp, destination)
+            return
+        except OSError:
+            pass
+    copyFileRange(source, temp)
+    shutil.copymode(source, temp)
+    os.replace(temp, destination)
+
+# Gets the path a staged file is written to: its name in the destination, or its path if `preserveStructure` is set
+# Paths that would end up outside the destination (absolute paths, `..`) are rejected
+def stagedPath(destinationDir, relative, preserveStructure):
+    relative = os.path.normpath(relative)
+    if os.path.isabs(relative) or relative == '..' or relative.startswith('..' + os.sep):
+        return None
+    return os.path.join(destinationDir, relative if preserveStructure else os.path.basename(relative))
+
+# Writes one archive member (a readable file object) to `destination`, counting its bytes against `budget`
+# Returns the number of bytes written
+def writeMember(member, destination, budget):
+    written = 0
+    with open(destination, 'wb') as file:
+        for chunk in iter(lambda: member.read(1 << 16), b''):
+            written += len(chunk)
+            if written > budget:
+                raise ArchiveError('the archives in the submission are larger than %d bytes' % maxArchiveBytes)
+            file.write(chunk)
+    return written
+
+# Extracts the files of an archive whose names match `includes` (and not `excludes`)
+# `limits` is a [entries left, bytes left] list shared by every archive of the submission
+# The path of every file in the archive (staged or not) is added to `contents`
+# The files are extracted into a temporary folder first, and only moved into place once the whole archive has been
+# read within the limits, so an archive that is skipped leaves nothing behind
+# Returns the paths of the staged files
+def extractArchive(path, destinationDir, includes, excludes, preserveStructure, limits, contents):
+    os.makedirs(destinationDir, exist_ok=True)
+    temp = tempfile.mkdtemp(prefix='.archive-', dir=destinationDir)
+    try:
+        # (extracted file, staged path) of every extracted file, in archive order
+        extracted = readArchive(path, destinationDir, includes, excludes, preserveStructure, limits, contents, temp)
+        for source, destination in extracted:
+            os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+            os.replace(source, destination)
+    finally:
+        shutil.rmtree(temp, ignore_errors=True)
+    return [destination for source, destination in extracted]
+
+# Reads an archive for extractArchive, writing the files to stage into `temp` (one file per entry)
+# Returns the (extracted file, staged path) of every file to stage
+def readArchive(path, destinationDir, includes, excludes, preserveStructure, limits, contents, temp):
+    staged = []
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                limits[0] -= 1
+                if limits[0] < 0:
+                    raise ArchiveError('the archives in the submission have more than %d files' % maxArchiveEntries)
+                contents.append(info.filename)
+                name = os.path.basename(info.filename)
+                if not matches(name, includes) or matches(name, excludes):
+                    continue
+                destination = stagedPath(destinationDir, info.filename, preserveStructure)
+                if destination is None:
+                    continue
+                extracted = os.path.join(temp, str(len(staged)))
+                with archive.open(info) as member:
+                    limits[1] -= writeMember(member, extracted, limits[1])
+                staged.append((extracted, destination))
+        return staged
+
+    try:
+        archive = tarfile.open(path, 'r:*')
+    except tarfile.TarError as error:
+        raise ArchiveError('%s could not be read (%s)' % (os.path.basename(path), error))
+    with archive:
+        for info in archive:
+            # Links, devices and folders are never extracted
+            if not info.isfile():
+                continue
+            limits[0] -= 1
+            if limits[0] < 0:
+                raise ArchiveError('the archives in the submission have more than %d files' % maxArchiveEntries)
+            contents.append(info.name)
+            name = os.path.basename(info.name)
+            if not matches(name, includes) or matches(name, excludes):
+                continue
+            destination = stagedPath(destinationDir, info.name, preserveStructure)
+            if destination is None:
+                continue
+            if info.size > limits[1]:
+                raise ArchiveError('the archives in the submission are larger than %d bytes' % maxArchiveBytes)
+            extracted = os.path.join(temp, str(len(staged)))
+            limits[1] -= writeMember(archive.extractfile(info), extracted, limits[1])
+            staged.append((extracted, destination))
+    return staged
+
+# Writes the list of the files inside the submission's archives (see archiveContentsName), or removes an old list
+# if the submission has no archives
+def writeArchiveContents(destinationDir, contents):
+    path = os.path.join(destinationDir, archiveContentsName)
+    if not contents:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return
+    with open(path, 'w') as file:
+        file.writelines(name + '\n' for name in contents)
+
+# Stages a submission into `destinationDir` and returns the paths of the staged files
+# Files are staged in path order, so when flattened files share a name, the last one (in path order) is kept
+# The files inside its archives are listed in `destinationDir` (see writeArchiveContents)
+def stageSubmission(submissionDir, destinationDir, includes=defaultIncludePatterns, excludes=(), preserveStructure=False,
+                    link=True, extractArchives=True):
+    staged = []
+    contents = []
+    limits = [maxArchiveEntries, maxArchiveBytes]
+    for relative, path in walkFiles(submissionDir):
+        name = os.path.basename(relative)
+        if matches(name, excludes):
+            continue
+        if extractArchives and matches(name, archivePatterns):
+            try:
+                archiveContents = []
+                staged += extractArchive(path, destinationDir, includes, excludes, preserveStructure, limits, archiveContents)
+                contents += archiveContents
+            except (ArchiveError, zipfile.BadZipFile, tarfile.TarError, OSError, EOFError, RuntimeError, NotImplementedError) as error:
+                # Encrypted zips raise RuntimeError, and unsupported compression methods NotImplementedError
+                print('Skipped archive %s: %s' % (relative, error), file=sys.stderr)
+        elif matches(name, includes):
+            destination = stagedPath(destinationDir, relative, preserveStructure)
+            placeFile(path, destination, link)
+            staged.append(destination)
+    writeArchiveContents(destinationDir, contents)
+    return staged
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Copy the files of a submission into the autograder\'s working directory')
+    parser.add_argument('submission', help='the submission folder (like /autograder/submission)')
+    parser.add_argument('destination', help='the folder the tests run in (like /autograder/source)')
+    parser.add_argument('--include', nargs='+', default=defaultIncludePatterns, metavar='PATTERN', help='names of the files to stage (default: %(default)s)')
+    parser.add_argument('--exclude', nargs='+', default=[], metavar='PATTERN', help='names of files (and archives) to leave out')
+    parser.add_argument('--preserve-structure', action='store_true', help='keep the submission\'s folders instead of staging every file at the top level')
+    parser.add_argument('--copy', action='store_true', help='always copy files instead of hard-linking them')
+    parser.add_argument('--no-archives', action='store_true', help='don\'t extract archives')
+    args = parser.parse_args()
+
+    stageSubmission(args.submission, args.destination, args.include, args.exclude, args.preserve_structure,
+                    link=not args.copy, extractArchives=not args.no_archives)
@@ -1,15 +1,33 @@
 import unittest
-# timeout.py
-import timeout
 # Requires gradescope_utils
 from gradescope_utils.autograder_utils.decorators import number, weight, visibility
-import subprocess
 from time import sleep
-from re import sub
 # utils.py
 from utils import *
 
+# Output tests: each row runs the student's program with an input file (or none) and compares its output with
+# a reference file. The test methods (test_<name>) are generated from this table by `outputTests` in utils.py,
+# which runs identical runs once, and runs every distinct run at the same time (see ExecutionPlan in utils.py)
+outputTable = [
+    # Run `make -s noinput` (which passes a command-line argument to `main.out` indicating no input is required)
+    OutputTest("3", 'Stdout', 'Check that stdout output is correct without input',
+               target='noinput', reference='reference/noinput.txt'),
+    OutputTest("4", 'StdoutInput1', 'Check that input "1" results in correct stdout output',
+               stdin='input/1.txt', reference='reference/1.txt'),
+    OutputTest("5", 'StdoutInput2', 'Check that input "2" results in correct stdout output',
+               stdin='input/2.txt', reference='reference/2.txt'),
+    OutputTest("6", 'StdoutInput3', 'Check that input "3" results in correct stdout output',
+               stdin='input/3.txt', reference='reference/3.txt'),
+    OutputTest("7", 'StderrInvalidInput', 'Check that invalid input results in correct stderr output',
+               stdin='input/invalid.txt', reference='reference/invalid_stderr.txt', stream='stderr'),
+    # Compares stderr if the program only printed to stderr, and stdout otherwise
+    OutputTest("8", 'MixedStdoutStderrOutput', 'Check that program outputs to both stdout and stderr',
+               stdin='input/invalid.txt', reference={'stdout': 'reference/invalid_stdout.txt', 'stderr': 'reference/invalid_stderr.txt'},
+               comparator=compareStdoutOrStderr),
+]
+
 # Main unit test class
+@outputTests(outputTable)
 class TestDiff(unittest.TestCase):
     # Array of all the expected file names
     files = ['main.c']
@@ -50,9 +68,10 @@ class TestDiff(unittest.TestCase):
 
         checkSourceFiles(self, self.files)
 
-        # Create a subprocess to run the student's Makefile to ensure it compiles
-        test = subprocess.Popen(["make"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
+        # Run the student's Makefile to ensure it compiles (in its own session, so make and everything it started
+        # are stopped with it), or restore the executables and compiler output of an identical earlier compile
+        test = compileProgram(self.executables)
+        stdout, stderr = test.stdout, test.stderr
         
         # Try to decode stderr
         try:
@@ -66,313 +85,3 @@ class TestDiff(unittest.TestCase):
             kill_fail(test, self, compileDecodeErrorMessage)
         
         test.terminate()
-
-    # Associated test number within Gradescope
-    @number("3")
-    # Test visibility
-    @visibility("visible")
-    # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
-    # Associated point value within Gradescope
-    @weight(15)
-    def test_Stdout(self):
-        # Title used by Gradescope 
-        """Check that stdout output is correct without input"""
-        
-        checkExecutables(self, self.executables)
-
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["make -s noinput"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
-        
-        try:
-            checkRuntimeErrors(test, self, stdout, stderr)
-            
-            # Try to decode stdout
-            try:
-                stdout = checkForUninitializedChars(stdout.strip().decode('utf-8'))
-                test.kill()
-                
-                # Open reference output and decode
-                reference = open('reference/noinput.txt', 'rb').read().strip().decode('utf-8')
-                
-                # Remove empty lines from both output and reference
-                stdout = removeEmptyLines(stdout)
-                reference = removeEmptyLines(reference)
-                
-                # Check the contents of stdout against reference
-                self.customCompare(stdout, reference, msg='Program output does not match expected output')
-            
-            # Catch exception for decode error
-            except (UnicodeDecodeError):
-                kill_fail(test, self, decodeErrorMessage)
-                
-            # Catch exception for uninitialized characters
-            except (UninitializedCharError):
-                kill_fail(test, self, uninitializedCharacterMessage)
-        
-        # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
-            pass
-        
-        test.terminate()
-
-    # Associated test number within Gradescope
-    @number("4")
-    # Test visibility
-    @visibility("visible")
-    # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
-    # Associated point value within Gradescope
-    @weight(15)
-    def test_StdoutInput1(self):
-        # Title used by Gradescope 
-        """Check that input "1" results in correct stdout output"""
-        
-        checkExecutables(self, self.executables)
-
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["make -s run < input/1.txt"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
-        
-        try:
-            checkRuntimeErrors(test, self, stdout, stderr)
-            
-            # Try to decode stdout
-            try:
-                stdout = checkForUninitializedChars(stdout.strip().decode('utf-8'))
-                test.kill()
-                
-                # Open reference output and decode
-                reference = open('reference/1.txt', 'rb').read().strip().decode('utf-8')
-                
-                # Remove empty lines from both output and reference
-                stdout = removeEmptyLines(stdout)
-                reference = removeEmptyLines(reference)
-                
-                # Check the contents of stdout against reference
-                self.customCompare(stdout, reference, msg='Program output does not match expected output')
-            
-            # Catch exception for decode error
-            except (UnicodeDecodeError):
-                kill_fail(test, self, decodeErrorMessage)
-                
-            # Catch exception for uninitialized characters
-            except (UninitializedCharError):
-                kill_fail(test, self, uninitializedCharacterMessage)
-        
-        # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
-            pass
-        
-        test.terminate()
-    
-    # Associated test number within Gradescope
-    @number("5")
-    # Test visibility
-    @visibility("visible")
-    # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
-    # Associated point value within Gradescope
-    @weight(15)
-    def test_StdoutInput2(self):
-        # Title used by Gradescope 
-        """Check that input "2" results in correct stdout output"""
-        
-        checkExecutables(self, self.executables)
-
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["make -s run < input/2.txt"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
-        
-        try:
-            checkRuntimeErrors(test, self, stdout, stderr)
-            
-            # Try to decode stdout
-            try:
-                stdout = checkForUninitializedChars(stdout.strip().decode('utf-8'))
-                test.kill()
-                
-                # Open reference output and decode
-                reference = open('reference/2.txt', 'rb').read().strip().decode('utf-8')
-                
-                # Remove empty lines from both output and reference
-                stdout = removeEmptyLines(stdout)
-                reference = removeEmptyLines(reference)
-                
-                # Check the contents of stdout against reference
-                self.customCompare(stdout, reference, msg='Program output does not match expected output')
-            
-            # Catch exception for decode error
-            except (UnicodeDecodeError):
-                kill_fail(test, self, decodeErrorMessage)
-                
-            # Catch exception for uninitialized characters
-            except (UninitializedCharError):
-                kill_fail(test, self, uninitializedCharacterMessage)
-        
-        # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
-            pass
-        
-        test.terminate()
-    
-    # Associated test number within Gradescope
-    @number("6")
-    # Test visibility
-    @visibility("visible")
-    # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
-    # Associated point value within Gradescope
-    @weight(15)
-    def test_StdoutInput3(self):
-        # Title used by Gradescope 
-        """Check that input "3" results in correct stdout output"""
-        
-        checkExecutables(self, self.executables)
-
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["make -s run < input/3.txt"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
-        
-        try:
-            checkRuntimeErrors(test, self, stdout, stderr)
-            
-            # Try to decode stdout
-            try:
-                stdout = checkForUninitializedChars(stdout.strip().decode('utf-8'))
-                test.kill()
-                
-                # Open reference output and decode
-                reference = open('reference/3.txt', 'rb').read().strip().decode('utf-8')
-                
-                # Remove empty lines from both output and reference
-                stdout = removeEmptyLines(stdout)
-                reference = removeEmptyLines(reference)
-                
-                # Check the contents of stdout against reference
-                self.customCompare(stdout, reference, msg='Program output does not match expected output')
-            
-            # Catch exception for decode error
-            except (UnicodeDecodeError):
-                kill_fail(test, self, decodeErrorMessage)
-                
-            # Catch exception for uninitialized characters
-            except (UninitializedCharError):
-                kill_fail(test, self, uninitializedCharacterMessage)
-        
-        # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
-            pass
-        
-        test.terminate()
-    
-    # Associated test number within Gradescope
-    @number("7")
-    # Test visibility
-    @visibility("visible")
-    # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
-    # Associated point value within Gradescope
-    @weight(15)
-    def test_StderrInvalidInput(self):
-        # Title used by Gradescope 
-        """Check that invalid input results in correct stderr output"""
-        
-        checkExecutables(self, self.executables)
-
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["make -s run < input/invalid.txt"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
-        
-        try:
-            checkRuntimeErrors(test, self, stdout, stderr)
-            
-            # Try to decode stderr
-            try:
-                stderr = checkForUninitializedChars(stderr.strip().decode('utf-8'))
-                test.kill()
-                
-                # Open reference output and decode
-                reference = open('reference/invalid_stderr.txt', 'rb').read().strip().decode('utf-8')
-                
-                # Remove empty lines from both output and reference
-                stderr = removeEmptyLines(stderr)
-                reference = removeEmptyLines(reference)
-                
-                # Check the contents of stdout against reference
-                self.customCompare(stdout, reference, msg='Program output does not match expected output')
-            
-            # Catch exception for decode error
-            except (UnicodeDecodeError):
-                kill_fail(test, self, decodeErrorMessage)
-                
-            # Catch exception for uninitialized characters
-            except (UninitializedCharError):
-                kill_fail(test, self, uninitializedCharacterMessage)
-        
-        # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
-            pass
-        
-        test.terminate()
-    
-    # Associated test number within Gradescope
-    @number("8")
-    # Test visibility
-    @visibility("visible")
-    # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
-    # Associated point value within Gradescope
-    @weight(15)
-    def test_MixedStdoutStderrOutput(self):
-        # Title used by Gradescope 
-        """Check that program outputs to both stdout and stderr"""
-        
-        checkExecutables(self, self.executables)
-
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["make -s run < input/invalid.txt"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
-        
-        try:
-            checkRuntimeErrors(test, self, stdout, stderr)
-            
-            # Try to decode stdout and stderr
-            try:
-                stdout = checkForUninitializedChars(stdout.strip().decode('utf-8'))
-                stderr = checkForUninitializedChars(stderr.strip().decode('utf-8'))
-                test.kill()
-                
-                # Open reference output and decode
-                reference_stdout = open('reference/invalid_stdout.txt', 'rb').read().strip().decode('utf-8')
-                reference_stderr = open('reference/invalid_stderr.txt', 'rb').read().strip().decode('utf-8')
-                
-                # Remove empty lines from both output and reference
-                stdout = removeEmptyLines(stdout)
-                stderr = removeEmptyLines(stderr)
-                reference_stdout = removeEmptyLines(reference_stdout)
-                reference_stderr = removeEmptyLines(reference_stderr)
-                
-                # Check if stdout is empty but stderr has content
-                if not stdout and stderr:
-                    # Check that stderr and reference are equal
-                    self.customCompare(stderr, reference_stderr, msg='Program output does not match expected output')
-                # If stderr is not usable for comparison, test with stdout
-                else:
-                    # Check that stdout and reference are equal
-                    self.customCompare(stdout, reference_stdout, msg='Program output does not match expected output')
-            
-            # Catch exception for decode error
-            except (UnicodeDecodeError):
-                kill_fail(test, self, decodeErrorMessage)
-                
-            # Catch exception for uninitialized characters
-            except (UninitializedCharError):
-                kill_fail(test, self, uninitializedCharacterMessage)
-        
-        # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
-            pass
-        
-        test.terminate()
@@ -9,12 +9,20 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import division
 
+import os
 import sys
 import time
+import heapq
+import itertools
+import threading
 import multiprocessing
+import multiprocessing.connection
 import signal
+from contextlib import contextmanager
 from functools import wraps
 
+import tracing
+
 ############################################################
 # Timeout
 ############################################################
@@ -47,15 +55,21 @@ def _raise_exception(exception, exception_message):
         raise exception(exception_message)
 
 
-def timeout(seconds=None, use_signals=True, timeout_exception=TimeoutError, exception_message=None):
+def timeout(seconds=None, use_signals=True, timeout_exception=TimeoutError, exception_message=None, use_watchdog=False):
     """Add a timeout parameter to a function and return it.
 
     :param seconds: optional time limit in seconds or fractions of a second. If None is passed, no timeout is applied.
         This adds some flexibility to the usage: you can disable timing out depending on the settings.
     :type seconds: float
     :param use_signals: flag indicating whether signals should be used for timing function out or the multiprocessing
-        When using multiprocessing, timeout granularity is limited to 10ths of a second.
+        When using multiprocessing, the caller blocks on the child's result pipe until the result arrives or the
+        time limit passes, so no CPU is spent waiting.
     :type use_signals: bool
+    :param use_watchdog: flag indicating whether the time limit should be enforced on the processes started through
+        `watch` instead of on the function itself. The function runs in the calling process (nothing is forked), and
+        one shared watchdog thread kills any watched process still running at the deadline. Takes precedence over
+        use_signals.
+    :type use_watchdog: bool
 
     :raises: TimeoutError if time limit is reached
 
@@ -64,7 +78,21 @@ def timeout(seconds=None, use_signals=True, timeout_exception=TimeoutError, exce
     """
     def decorate(function):
 
-        if use_signals:
+        if use_watchdog:
+            @wraps(function)
+            def new_function(*args, **kwargs):
+                new_seconds = kwargs.pop('timeout', seconds)
+                previous = getattr(_context, 'limit', None)
+                if new_seconds:
+                    _context.limit = (time.monotonic() + new_seconds, timeout_exception, exception_message)
+                else:
+                    _context.limit = None
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    _context.limit = previous
+            return new_function
+        elif use_signals:
             def handler(signum, frame):
                 _raise_exception(timeout_exception, exception_message)
 
@@ -95,18 +123,36 @@ def timeout(seconds=None, use_signals=True, timeout_exception=TimeoutError, exce
     return decorate
 
 
-def _target(queue, function, *args, **kwargs):
-    """Run a function with arguments and return output via a queue.
+def _terminate(signum, frame):
+    """Turn the SIGTERM sent by _Timeout.cancel into an exception, so cleanup code runs before the child exits."""
+    raise SystemExit(128 + signum)
+
+
+def _target(connection, function, *args, **kwargs):
+    """Run a function with arguments and return output via a pipe.
 
     This is a helper function for the Process created in _Timeout. It runs
     the function with positional arguments and keyword arguments and then
-    returns the function's output by way of a queue. If an exception gets
+    returns the function's output by way of a pipe. If an exception gets
     raised, it is returned to _Timeout to be raised by the value property.
+    If the function is cancelled, its finally blocks (which reap any
+    processes it started) run before the child exits.
     """
+    signal.signal(signal.SIGTERM, _terminate)
     try:
-        queue.put((True, function(*args, **kwargs)))
+        connection.send((True, function(*args, **kwargs)))
+    except SystemExit:
+        raise
     except:
-        queue.put((False, sys.exc_info()[1]))
+        connection.send((False, sys.exc_info()[1]))
+    finally:
+        connection.close()
+        # The child exits without running atexit handlers, so write out its trace spans now
+        tracing.flush()
+
+
+# Seconds a cancelled child gets to reap the processes it started before it is killed
+_CANCEL_GRACE_PERIOD = 1
 
 
 class _Timeout(object):
@@ -126,50 +172,170 @@ class _Timeout(object):
         self.__exception_message = exception_message
         self.__name__ = function.__name__
         self.__doc__ = function.__doc__
-        self.__timeout = time.time()
+        self.__timeout = time.monotonic()
         self.__process = multiprocessing.Process()
-        self.__queue = multiprocessing.Queue()
+        self.__connection = None
 
     def __call__(self, *args, **kwargs):
         """Execute the embedded function object asynchronously.
 
-        The function given to the constructor is transparently called and
-        requires that "ready" be intermittently polled. If and when it is
-        True, the "value" property may then be checked for returned data.
+        The function given to the constructor is transparently called in a
+        child process. The caller blocks on the child's result pipe (and its
+        sentinel) until the result arrives or the time limit passes, then
+        the "value" property is checked for returned data.
         """
         self.__limit = kwargs.pop('timeout', self.__limit)
-        self.__queue = multiprocessing.Queue(1)
-        args = (self.__queue, self.__function) + args
+        self.__connection, writer = multiprocessing.Pipe(duplex=False)
+        args = (writer, self.__function) + args
         self.__process = multiprocessing.Process(target=_target,
                                                  args=args,
                                                  kwargs=kwargs)
         self.__process.daemon = True
-        self.__process.start()
-        if self.__limit is not None:
-            self.__timeout = self.__limit + time.time()
-        while not self.ready:
-            time.sleep(0.01)
-        return self.value
+        with tracing.span('timeout: start process'):
+            self.__process.start()
+        # Only the child writes; closing our copy lets the pipe report EOF if the child dies
+        writer.close()
+        if self.__limit:
+            self.__timeout = self.__limit + time.monotonic()
+        with tracing.span('timeout: wait for result'):
+            while not self.ready:
+                remaining = self.__timeout - time.monotonic() if self.__limit else None
+                multiprocessing.connection.wait([self.__connection, self.__process.sentinel],
+                                                timeout=None if remaining is None else max(remaining, 0))
+            return self.value
 
     def cancel(self):
         """Terminate any possible execution of the embedded function."""
         if self.__process.is_alive():
             self.__process.terminate()
+            # Give the child a moment to clean up after itself, then make sure it is gone
+            self.__process.join(_CANCEL_GRACE_PERIOD)
+            if self.__process.is_alive():
+                self.__process.kill()
+                self.__process.join()
+        self.__connection.close()
 
         _raise_exception(self.__timeout_exception, self.__exception_message)
 
     @property
     def ready(self):
         """Read-only property indicating status of "value" property."""
-        if self.__limit and self.__timeout < time.time():
+        if self.__connection.poll():
+            return True
+        if self.__limit and self.__timeout <= time.monotonic():
             self.cancel()
-        return self.__queue.full() and not self.__queue.empty()
+        return False
 
     @property
     def value(self):
         """Read-only property containing data returned from function."""
         if self.ready is True:
-            flag, load = self.__queue.get()
+            try:
+                flag, load = self.__connection.recv()
+            except EOFError:
+                # The child exited without sending a result, so it can never finish in time
+                self.cancel()
+            finally:
+                self.__connection.close()
             if flag:
                 return load
-            raise load
\ No newline at end of file
+            raise load
+
+
+############################################################
+# Watchdog
+############################################################
+
+class _Watch(object):
+
+    """A process registered with the watchdog, and whether it was killed."""
+
+    def __init__(self, kill):
+        self.kill = kill
+        self.cancelled = False
+        self.expired = False
+
+
+class _Watchdog(object):
+
+    """Kill watched processes once their deadlines pass.
+
+    A single daemon thread sleeps on a heap of deadlines, so any number of
+    concurrent runs share one timer and no process is forked to enforce a
+    time limit. The thread is started on first use in each process.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        """Forget the state inherited from a parent process (threads do not survive a fork)."""
+        self.__condition = threading.Condition()
+        self.__heap = []
+        self.__counter = itertools.count()
+        self.__thread = None
+
+    def watch(self, deadline, kill):
+        """Call kill() if the returned watch is still registered at deadline (a time.monotonic() value)."""
+        watch = _Watch(kill)
+        with self.__condition:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name='timeout-watchdog')
+                self.__thread.daemon = True
+                self.__thread.start()
+            heapq.heappush(self.__heap, (deadline, next(self.__counter), watch))
+            self.__condition.notify()
+        return watch
+
+    def unwatch(self, watch):
+        """Stop watching; the entry is dropped from the heap lazily."""
+        with self.__condition:
+            watch.cancelled = True
+
+    def __run(self):
+        with self.__condition:
+            while True:
+                while self.__heap and self.__heap[0][2].cancelled:
+                    heapq.heappop(self.__heap)
+                if not self.__heap:
+                    self.__condition.wait()
+                    continue
+                remaining = self.__heap[0][0] - time.monotonic()
+                if remaining > 0:
+                    self.__condition.wait(remaining)
+                    continue
+                watch = heapq.heappop(self.__heap)[2]
+                watch.expired = True
+                try:
+                    watch.kill()
+                except OSError:
+                    pass
+
+
+_watchdog = _Watchdog()
+_context = threading.local()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_watchdog._reset)
+
+
+@contextmanager
+def watch(kill):
+    """Enforce the time limit of the enclosing `timeout(use_watchdog=True)` call on a process.
+
+    kill is called by the watchdog thread if the block is still running at
+    the deadline, after which the block exits and the timeout exception is
+    raised. Outside a watchdog-mode call this does nothing.
+    """
+    limit = getattr(_context, 'limit', None)
+    if limit is None:
+        yield
+        return
+
+    deadline, timeout_exception, exception_message = limit
+    watch = _watchdog.watch(deadline, kill)
+    try:
+        yield
+    finally:
+        _watchdog.unwatch(watch)
+    if watch.expired:
+        _raise_exception(timeout_exception, exception_message)
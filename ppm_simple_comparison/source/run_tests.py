@@ -1,6 +1,26 @@
+import argparse
+import os
 import unittest
-from gradescope_utils.autograder_utils.json_test_runner import JSONTestRunner
+# parallel_runner.py
+from parallel_runner import ParallelJSONTestRunner, ResourceJSONTestRunner
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the autograder tests and print results.json to stdout')
+    # Number of worker processes used for tests marked with `@parallel`; 0 uses every available core
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of tests to run concurrently (0 = number of cores, default: 1)')
+    # Turns on tracing.py before the tests (and utils.py) are imported
+    parser.add_argument('--trace', metavar='FILE', help='write a Chrome trace of the phases of every test to FILE (like ../results/trace.json)')
+    args = parser.parse_args()
+    if args.trace:
+        os.environ['AUTOGRADER_TRACE'] = os.path.abspath(args.trace)
+
     suite = unittest.defaultTestLoader.discover('tests')
-    JSONTestRunner(visibility='visible').run(suite)
\ No newline at end of file
+    # tracing.py (importable once the tests are discovered, because discovery adds the `tests` folder to the path)
+    import tracing
+    tracing.reset()
+    with tracing.span('run tests', 'runner'):
+        if args.jobs == 1:
+            ResourceJSONTestRunner(visibility='visible').run(suite)
+        else:
+            ParallelJSONTestRunner(jobs=args.jobs, visibility='visible').run(suite)
+    tracing.writeTrace()
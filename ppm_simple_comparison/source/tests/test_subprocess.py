@@ -3,9 +3,7 @@ import unittest
 import timeout
 # Requires gradescope_utils
 from gradescope_utils.autograder_utils.decorators import number, weight, visibility
-import subprocess
 from time import sleep
-from re import sub
 # utils.py
 from utils import *
 
@@ -50,9 +48,10 @@ class TestDiff(unittest.TestCase):
 
         checkSourceFiles(self, self.files)
 
-        # Create a subprocess to run the student's Makefile to ensure it compiles
-        test = subprocess.Popen(["make"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
+        # Run the student's Makefile to ensure it compiles (in its own session, so make and everything it started
+        # are stopped with it), or restore the executables and compiler output of an identical earlier compile
+        test = compileProgram(self.executables)
+        stdout, stderr = test.stdout, test.stderr
         
         # Try to decode stderr
         try:
@@ -71,8 +70,10 @@ class TestDiff(unittest.TestCase):
     @number("3")
     # Test visibility
     @visibility("visible")
+    # Allow this test to run concurrently with other output tests
+    @parallel()
     # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
+    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False, use_watchdog=True)
     # Associated point value within Gradescope
     @weight(10)
     def test_PPMWidth15Header(self):
@@ -81,23 +82,24 @@ class TestDiff(unittest.TestCase):
         
         checkExecutables(self, self.executables)
 
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["make -s run < input/15.txt"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
+        # Run the student's code (the command behind `make -s run`, without make or a shell) to obtain an output,
+        # reusing the result of an identical earlier run (output is allowed to be as large as the reference image in P3 form)
+        test = runProgram(makeTargetCommand('run', self.executables), stdin='input/15.txt', executables=self.executables,
+                          maxOutputBytes=ppmOutputBudget('reference/15.ppm'))
+        stdout, stderr = test.stdout, test.stderr
         
         try:
             checkRuntimeErrors(test, self, stdout, stderr)
             
-            # Try to decode stdout
+            # Try to decode the header
             try:
-                stdout = checkForUninitializedChars(stdout.strip().decode('utf-8'))
                 test.kill()
                 
                 # Array of expected lines of output, line by line in expected order
                 expected = ['P3', '15', '7', '255']
                 
-                # Split output by lines
-                header = stdout.split()
+                # Read the first four values of the image, without reading (or decoding) its pixel data
+                header = [checkForUninitializedChars(token.decode('utf-8')) for token in readPPMHeaderTokens(stdout)]
                 
                 # Check if header information is correct
                 try:
@@ -125,7 +127,7 @@ class TestDiff(unittest.TestCase):
                 kill_fail(test, self, uninitializedCharacterMessage)
         
         # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
+        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError, RuntimeOutputTooLarge):
             pass
         
         test.terminate()
@@ -134,8 +136,10 @@ class TestDiff(unittest.TestCase):
     @number("4")
     # Test visibility
     @visibility("visible")
+    # Allow this test to run concurrently with other output tests
+    @parallel()
     # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
+    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False, use_watchdog=True)
     # Associated point value within Gradescope
     @weight(32.5)
     def test_PPMWidth15Image(self):
@@ -144,38 +148,23 @@ class TestDiff(unittest.TestCase):
         
         checkExecutables(self, self.executables)
 
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["make -s run < input/15.txt"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
+        # Run the student's code (the command behind `make -s run`, without make or a shell) to obtain an output,
+        # reusing the result of an identical earlier run (output is allowed to be as large as the reference image in P3 form)
+        test = runProgram(makeTargetCommand('run', self.executables), stdin='input/15.txt', executables=self.executables,
+                          maxOutputBytes=ppmOutputBudget('reference/15.ppm'))
+        stdout, stderr = test.stdout, test.stderr
         
         try:
             checkRuntimeErrors(test, self, stdout, stderr)
             
-            # Try to decode stdout
-            try:
-                stdout = checkForUninitializedChars(stdout.strip().decode('utf-8'))
-                test.kill()
-                
-                # Open reference output and decode
-                reference = open('reference/15.ppm', 'rb').read().strip().decode('utf-8')
-                
-                # Remove empty lines from both output and reference
-                stdout = removeEmptyLines(stdout)
-                reference = removeEmptyLines(reference)
-                
-                # Check the contents of stdout against reference
-                self.customCompare(stdout, reference, msg='Program output does not match expected output')
+            test.kill()
             
-            # Catch exception for decode error
-            except (UnicodeDecodeError):
-                kill_fail(test, self, decodeErrorMessage)
-                
-            # Catch exception for uninitialized characters
-            except (UninitializedCharError):
-                kill_fail(test, self, uninitializedCharacterMessage)
+            # Compare the image (plain P3 or binary P6) with the reference image pixel by pixel, without decoding it
+            # (plain color values are compared as numbers, regardless of how they are split into lines)
+            assertPPMEqual(self, stdout, 'reference/15.ppm')
         
         # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
+        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError, RuntimeOutputTooLarge):
             pass
         
         test.terminate()
@@ -184,8 +173,10 @@ class TestDiff(unittest.TestCase):
     @number("5")
     # Test visibility
     @visibility("visible")
+    # Allow this test to run concurrently with other output tests
+    @parallel()
     # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
+    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False, use_watchdog=True)
     # Associated point value within Gradescope
     @weight(10)
     def test_PPMWidth42Header(self):
@@ -194,16 +185,17 @@ class TestDiff(unittest.TestCase):
         
         checkExecutables(self, self.executables)
 
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["make -s run < input/42.txt"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
+        # Run the student's code (the command behind `make -s run`, without make or a shell) to obtain an output,
+        # reusing the result of an identical earlier run (output is allowed to be as large as the reference image in P3 form)
+        test = runProgram(makeTargetCommand('run', self.executables), stdin='input/42.txt', executables=self.executables,
+                          maxOutputBytes=ppmOutputBudget('reference/42.ppm'))
+        stdout, stderr = test.stdout, test.stderr
         
         try:
             checkRuntimeErrors(test, self, stdout, stderr)
             
-            # Try to decode stdout
+            # Try to decode the header
             try:
-                stdout = checkForUninitializedChars(stdout.strip().decode('utf-8'))
                 test.kill()
                 
                 # Set msg to blank string, in case test passes
@@ -212,8 +204,8 @@ class TestDiff(unittest.TestCase):
                 # Array of expected lines of output, line by line in expected order
                 expected = ['P3', '42', '21', '255']
                 
-                # Split output by lines
-                header = stdout.split()
+                # Read the first four values of the image, without reading (or decoding) its pixel data
+                header = [checkForUninitializedChars(token.decode('utf-8')) for token in readPPMHeaderTokens(stdout)]
                 
                 # Check if header information is correct
                 try:
@@ -241,7 +233,7 @@ class TestDiff(unittest.TestCase):
                 kill_fail(test, self, uninitializedCharacterMessage)
         
         # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
+        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError, RuntimeOutputTooLarge):
             pass
         
         test.terminate()
@@ -250,8 +242,10 @@ class TestDiff(unittest.TestCase):
     @number("6")
     # Test visibility
     @visibility("visible")
+    # Allow this test to run concurrently with other output tests
+    @parallel()
     # Individual test case timeout (in seconds)
-    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False)
+    @timeout.timeout(10, exception_message=wrap(programTimeoutErrorMessage, 65), use_signals=False, use_watchdog=True)
     # Associated point value within Gradescope
     @weight(32.5)
     def test_PPMWidth42Image(self):
@@ -260,38 +254,23 @@ class TestDiff(unittest.TestCase):
         
         checkExecutables(self, self.executables)
 
-        # Create a subprocess to run the student's code to obtain an output
-        test = subprocess.Popen(["make -s run < input/42.txt"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = test.communicate()
+        # Run the student's code (the command behind `make -s run`, without make or a shell) to obtain an output,
+        # reusing the result of an identical earlier run (output is allowed to be as large as the reference image in P3 form)
+        test = runProgram(makeTargetCommand('run', self.executables), stdin='input/42.txt', executables=self.executables,
+                          maxOutputBytes=ppmOutputBudget('reference/42.ppm'))
+        stdout, stderr = test.stdout, test.stderr
         
         try:
             checkRuntimeErrors(test, self, stdout, stderr)
             
-            # Try to decode stdout
-            try:
-                stdout = checkForUninitializedChars(stdout.strip().decode('utf-8'))
-                test.kill()
-                
-                # Open reference output and decode
-                reference = open('reference/42.ppm', 'rb').read().strip().decode('utf-8')
-                
-                # Remove empty lines from both output and reference
-                stdout = removeEmptyLines(stdout)
-                reference = removeEmptyLines(reference)
-                
-                # Check the contents of stdout against reference
-                self.customCompare(stdout, reference, msg='Program output does not match expected output')
+            test.kill()
             
-            # Catch exception for decode error
-            except (UnicodeDecodeError):
-                kill_fail(test, self, decodeErrorMessage)
-                
-            # Catch exception for uninitialized characters
-            except (UninitializedCharError):
-                kill_fail(test, self, uninitializedCharacterMessage)
+            # Compare the image (plain P3 or binary P6) with the reference image pixel by pixel, without decoding it
+            # (plain color values are compared as numbers, regardless of how they are split into lines)
+            assertPPMEqual(self, stdout, 'reference/42.ppm')
         
         # Catch runtime error exceptions
-        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError):
+        except (RuntimeAbort, RuntimeSegFault, RuntimeFPE, RuntimeBusError, RuntimeIllegalInstruction, MakefileError, RuntimeOutputTooLarge):
             pass
         
         test.terminate()
@@ -0,0 +1,138 @@
+# Grades a directory of submissions with one autograder, several submissions at a time
+# Every submission is graded in its own copy of the autograder folder (`results/`, `source/`, `submission/`), by the
+# autograder's own `run_autograder` script, so tests run exactly like they do on Gradescope
+#
+# Usage (from the repository root):
+#   python3 regrade.py input_output_comparison/source path/to/submissions [-o regrade_results] [-j N]
+# `path/to/submissions` holds one folder per submission, containing the files the student uploaded
+# Writes `<output>/<submission>/results.json` (and the autograder's stderr in `autograder.log`) for every
+# submission, plus `<output>/summary.json` with the score and status of every submission
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from shutil import copyfile, copytree, ignore_patterns, rmtree
+
+# Files in the source folder that are left behind by local test runs and are not copied into workspaces
+ignoredSourceFiles = ignore_patterns('run_cache', 'compile_cache', '__pycache__')
+
+# Gets the number of cores this process may run on
+def availableCores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# Gets the name of every submission (every folder) in the submissions folder, in order
+def listSubmissions(submissionsDir):
+    return sorted(entry.name for entry in os.scandir(submissionsDir) if entry.is_dir())
+
+# Kills every process still running inside a workspace (with its working directory in the workspace)
+# Student programs run in sessions of their own, so killing the autograder's session does not reach them
+def killWorkspaceProcesses(workspace):
+    for attempt in range(10):
+        found = False
+        for pid in filter(str.isdigit, os.listdir('/proc')):
+            try:
+                if os.readlink(f'/proc/{pid}/cwd').startswith(workspace + os.sep):
+                    os.kill(int(pid), signal.SIGKILL)
+                    found = True
+            except OSError:
+                pass
+        if not found:
+            return
+        time.sleep(0.05)
+
+# Adds up the score and maximum score of a results.json
+# Uses the overall `score` if the runner wrote one, like Gradescope does
+def totalScore(results):
+    tests = results.get('tests', [])
+    score = results.get('score', sum(test.get('score', 0) for test in tests))
+    return score, sum(test.get('max_score', 0) for test in tests)
+
+# Grades one submission in a new workspace and returns its entry in summary.json
+# Runs in a worker process; the autograder runs in its own session, so a submission that hangs past
+# `timeoutSeconds` is stopped along with everything it started
+def gradeSubmission(sourceDir, submissionDir, resultDir, compileCache, timeoutSeconds, keep):
+    name = os.path.basename(submissionDir)
+    start = time.monotonic()
+    workspace = tempfile.mkdtemp(prefix='regrade-')
+    autograderDir = os.path.join(workspace, 'autograder')
+    entry = {'name': name, 'status': 'error', 'score': None, 'max_score': None}
+    try:
+        copytree(sourceDir, os.path.join(autograderDir, 'source'), ignore=ignoredSourceFiles)
+        copytree(submissionDir, os.path.join(autograderDir, 'submission'))
+        os.makedirs(os.path.join(autograderDir, 'results'))
+
+        env = dict(os.environ, AUTOGRADER_DIR=autograderDir, AUTOGRADER_COMPILE_CACHE=compileCache)
+        proc = subprocess.Popen(['bash', 'run_autograder'], cwd=os.path.join(autograderDir, 'source'), env=env,
+                                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, start_new_session=True)
+        try:
+            _, stderr = proc.communicate(timeout=timeoutSeconds)
+            status = 'graded'
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            killWorkspaceProcesses(workspace)
+            _, stderr = proc.communicate()
+            status = 'timeout'
+        entry['status'] = status
+
+        os.makedirs(resultDir, exist_ok=True)
+        with open(os.path.join(resultDir, 'autograder.log'), 'wb') as log:
+            log.write(stderr)
+
+        # A submission whose autograder didn't write a readable results.json is reported as an error
+        with open(os.path.join(autograderDir, 'results', 'results.json')) as file:
+            results = json.load(file)
+        entry['score'], entry['max_score'] = totalScore(results)
+        copyfile(os.path.join(autograderDir, 'results', 'results.json'), os.path.join(resultDir, 'results.json'))
+    except (OSError, ValueError):
+        if entry['status'] == 'graded':
+            entry['status'] = 'error'
+    finally:
+        if not keep:
+            rmtree(workspace, ignore_errors=True)
+
+    entry['elapsed'] = round(time.monotonic() - start, 3)
+    if keep:
+        entry['workspace'] = autograderDir
+    return entry
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Grade every submission in a folder with an autograder')
+    parser.add_argument('source', help='the autograder\'s source folder (like input_output_comparison/source)')
+    parser.add_argument('submissions', help='folder with one folder of uploaded files per submission')
+    parser.add_argument('-o', '--output', default='regrade_results', help='folder for the results of every submission (default: regrade_results)')
+    parser.add_argument('-j', '--jobs', type=int, default=0, help='number of submissions graded at once (0 = number of cores, default: 0)')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds a single submission may take before it is stopped (default: 600)')
+    parser.add_argument('--compile-cache', help='compile cache shared by every submission (default: <output>/compile_cache)')
+    parser.add_argument('--keep', action='store_true', help='keep every submission\'s workspace instead of deleting it')
+    args = parser.parse_args()
+
+    sourceDir = os.path.abspath(args.source)
+    submissionsDir = os.path.abspath(args.submissions)
+    outputDir = os.path.abspath(args.output)
+    compileCache = os.path.abspath(args.compile_cache or os.path.join(outputDir, 'compile_cache'))
+    if not os.path.isfile(os.path.join(sourceDir, 'run_autograder')):
+        parser.error(f'{args.source} does not contain a run_autograder script')
+    names = listSubmissions(submissionsDir)
+    os.makedirs(outputDir, exist_ok=True)
+
+    start = time.monotonic()
+    summary = []
+    with ProcessPoolExecutor(max_workers=args.jobs or availableCores()) as pool:
+        futures = [pool.submit(gradeSubmission, sourceDir, os.path.join(submissionsDir, name), os.path.join(outputDir, name),
+                               compileCache, args.timeout, args.keep) for name in names]
+        for future in as_completed(futures):
+            entry = future.result()
+            summary.append(entry)
+            print(f'[{len(summary)}/{len(names)}] {entry["name"]}: {entry["status"]}, score {entry["score"]} / {entry["max_score"]} ({entry["elapsed"]}s)', file=sys.stderr)
+
+    summary.sort(key=lambda entry: entry['name'])
+    with open(os.path.join(outputDir, 'summary.json'), 'w') as file:
+        json.dump({'source': sourceDir, 'submissions': summary, 'elapsed': round(time.monotonic() - start, 3)}, file, indent=2)
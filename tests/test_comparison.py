@@ -0,0 +1,180 @@
+# Tests for the output comparison in `source/tests/utils.py`: the line diff, the output normalizer, the streaming
+# comparison and the PPM parser
+#
+# Usage (from the repository root):
+#   python3 -m unittest discover tests
+import os
+import re
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_output_comparison', 'source', 'tests'))
+# utils.py
+import utils
+
+# Original implementation of removeEmptyLines, which Normalizer replaced
+def legacyRemoveEmptyLines(text):
+    lst = filter(lambda s: len(s.strip()) != 0, list(map(lambda s: re.sub(' +', ' ', s.strip()), text.split("\n"))))
+    return "\n".join(list(lst)) + "\n"
+
+# Gets the smallest number of lines that have to be deleted or inserted to turn `a` into `b` (from the longest
+# common subsequence)
+def editDistance(a, b):
+    lengths = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i in range(len(a)):
+        for j in range(len(b)):
+            lengths[i + 1][j + 1] = lengths[i][j] + 1 if a[i] == b[j] else max(lengths[i][j + 1], lengths[i + 1][j])
+    return len(a) + len(b) - 2 * lengths[len(a)][len(b)]
+
+class TestLineDiff(unittest.TestCase):
+    cases = [
+        ([], []),
+        (['a'], []),
+        ([], ['a']),
+        (['a', 'b', 'c'], ['a', 'b', 'c']),
+        (['a', 'b', 'c'], ['a', 'x', 'c']),
+        (['a', 'b', 'c'], ['a', 'c']),
+        (['a', 'c'], ['a', 'b', 'c']),
+        (list('abcabba'), list('cbabac')),
+        (list('abgdef'), list('gh')),
+        (list('xaxbxcx'), list('abc')),
+        (['1', '2', '3', '4', '5', '6'], ['6', '5', '4', '3', '2', '1']),
+        (['same'] * 5 + ['old'] + ['same'] * 5, ['same'] * 5 + ['new', 'extra'] + ['same'] * 5),
+    ]
+
+    # The opcodes turn `a` into `b`, with as few deleted and inserted lines as possible
+    def test_MinimalDiff(self):
+        for a, b in self.cases:
+            opcodes = utils.lineDiffOpcodes(a, b)
+            result = []
+            for tag, i1, i2, j1, j2 in opcodes:
+                if tag == 'equal':
+                    self.assertEqual(a[i1:i2], b[j1:j2])
+                    result += a[i1:i2]
+                else:
+                    result += b[j1:j2]
+            self.assertEqual(result, b, (a, b))
+            edits = sum((i2 - i1) + (j2 - j1) for tag, i1, i2, j1, j2 in opcodes if tag != 'equal')
+            self.assertEqual(edits, editDistance(a, b), (a, b))
+
+    # Outputs more than `maxEdits` lines apart are shown as one changed hunk between the common prefix and suffix
+    def test_MaxEdits(self):
+        a = ['start'] + [str(index) for index in range(20)] + ['end']
+        b = ['start'] + [str(-index) for index in range(1, 21)] + ['end']
+        self.assertEqual(utils.lineDiffOpcodes(a, b, maxEdits=5), [('equal', 0, 1, 0, 1), ('replace', 1, 21, 1, 21), ('equal', 21, 22, 21, 22)])
+
+class TestNormalizer(unittest.TestCase):
+    # The default rules behave like the original removeEmptyLines
+    def test_MatchesRemoveEmptyLines(self):
+        samples = ['', '\n', 'a', 'a\n', '  a   b  \n\n   \n c\n', 'x\n\n\ny', ' \t\n\t line \t\n', 'one  two   three\n']
+        for text in samples:
+            self.assertEqual(utils.removeEmptyLines(text), legacyRemoveEmptyLines(text), repr(text))
+            self.assertEqual(utils.defaultNormalizer(text.encode()), legacyRemoveEmptyLines(text).encode(), repr(text))
+
+    # CRLF line endings are turned into plain newlines before the per-line rules run
+    def test_CRLF(self):
+        normalizer = utils.Normalizer(('crlf', 'trimTrailingWhitespace'))
+        self.assertEqual(normalizer('a  \r\nb\r\n\r\nc'), 'a\nb\n\nc')
+        self.assertEqual(normalizer(b'a\r\nb \r\n'), b'a\nb\n')
+
+    # Blank lines are removed, and the output then always ends with exactly one newline
+    def test_RemoveBlankLines(self):
+        normalizer = utils.Normalizer(('removeBlankLines',))
+        self.assertEqual(normalizer('\n\na\n  \nb'), 'a\nb\n')
+        self.assertEqual(normalizer(' a \n\n'), ' a \n')
+        self.assertEqual(utils.Normalizer(('crlf', 'removeBlankLines'))('a\r\n\r\n\r\nb\r\n'), 'a\nb\n')
+
+    def test_CaseFoldAndCustomRules(self):
+        normalizer = utils.Normalizer(('caseFold', lambda text: text.replace('x', 'y')))
+        self.assertEqual(normalizer('AXB'), 'ayb')
+
+    def test_UnknownRule(self):
+        with self.assertRaises(ValueError):
+            utils.Normalizer(('stripLines', 'noSuchRule'))
+
+class TestStreamingComparison(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.reference = os.path.join(self.directory.name, 'reference.txt')
+        with open(self.reference, 'w') as file:
+            file.write('first line\n\nsecond  line\nthird\nfourth\nfifth\nsixth\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Feeds `output` in chunks of `size` bytes, and returns (matched, divergedAt)
+    def stream(self, output, size):
+        comparison = utils.StreamingComparison(self.reference)
+        matched = True
+        for index in range(0, len(output), size):
+            if not comparison.feed(output[index:index + size]):
+                matched = False
+                break
+        else:
+            matched = comparison.finish()
+        return matched, comparison.divergedAt
+
+    # Blank lines and extra spaces don't count, wherever the chunks are split
+    def test_MatchingOutput(self):
+        output = b'  first line \n\n\nsecond line\nthird\nfourth\nfifth\nsixth'
+        for size in (1, 3, 7, len(output)):
+            self.assertEqual(self.stream(output, size), (True, None))
+
+    # The comparison stops at the first wrong line, wherever the chunks are split
+    def test_Divergence(self):
+        output = b'first line\nsecond line\nTHIRD\nfourth\n' + b'more\n' * 1000
+        for size in (1, 5, 64, len(output)):
+            self.assertEqual(self.stream(output, size), (False, 2))
+        self.assertEqual(self.stream(b'first line\nsecond line\nthird\nfourth\nfifth\nsixth\nseventh\n', 4), (False, 6))
+        self.assertEqual(self.stream(b'first line\n\xff\n', 4), (False, 1))
+
+    # The diff of a run stopped at its first wrong line only shows a few lines after it
+    def test_LimitToDivergence(self):
+        run = utils.ProgramRun(0, b'', b'', 0)
+        text = ''.join('line %d\n' % index for index in range(20))
+        self.assertEqual(utils.limitToDivergence(text, run), text)
+        run.divergedAt = 2
+        self.assertEqual(utils.limitToDivergence(text, run), ''.join('line %d\n' % index for index in range(2 + 1 + utils.divergenceContextLines)))
+
+class TestPPM(unittest.TestCase):
+    # Plain values may be wrapped into lines any way, with comments anywhere after the header label
+    def test_PlainImage(self):
+        image = utils.readPPM(b'P3\n# comment\n2 1\n255\n255 0 0 # red\n0\n255 0\n')
+        self.assertEqual((image.magic, image.width, image.height, image.maxval), ('P3', 2, 1, 255))
+        self.assertEqual([image.value(index) for index in range(6)], [255, 0, 0, 0, 255, 0])
+        self.assertEqual(utils.readPPM('P3 1 1 65535 65535 0 1').value(0), 65535)
+
+    def test_BinaryImage(self):
+        image = utils.readPPM(b'P6\n2 1\n255\n' + bytes([1, 2, 3, 4, 5, 6]))
+        self.assertEqual([image.value(index) for index in range(6)], [1, 2, 3, 4, 5, 6])
+        wide = utils.readPPM(b'P6 1 1 1000 ' + (1000).to_bytes(2, 'big') + (0).to_bytes(2, 'big') + (7).to_bytes(2, 'big'))
+        self.assertEqual([wide.value(index) for index in range(3)], [1000, 0, 7])
+
+    # Plain and binary versions of an image compare equal, and the first differing pixel is found
+    def test_Compare(self):
+        plain = utils.readPPM(b'P3 2 1 255 10 20 30 40 50 60')
+        binary = utils.readPPM(b'P6 2 1 255\n' + bytes([10, 20, 30, 40, 50, 60]))
+        self.assertIsNone(utils.comparePPM(plain, binary))
+        comparison = utils.comparePPM(utils.readPPM(b'P3 2 1 255 10 20 30 40 51 60'), binary)
+        self.assertEqual((comparison.differingPixels, comparison.firstDifference), (1, (1, 0, 1)))
+
+    def assertPPMError(self, data, message):
+        with self.assertRaises(utils.PPMFormatError) as context:
+            utils.readPPM(data)
+        self.assertIn(message, str(context.exception))
+
+    def test_Errors(self):
+        self.assertPPMError(b'P3 2 1', 'header is too short')
+        self.assertPPMError(b'P5 1 1 255 0', 'Your header label: P5, expected header label: P3 or P6')
+        self.assertPPMError(b'P3 1 x 255 0 0 0', 'header contains a value that is not a number')
+        self.assertPPMError(b'P3 1 1 0 0 0 0', 'Your width, height and maximum pixel value: 1 1 0')
+        self.assertPPMError(b'P3 1 1 255 0 0 a', 'color value that is not a number')
+        self.assertPPMError(b'P3 1 1 100 0 101 0', 'outside of the range 0 to 100')
+        self.assertPPMError(b'P3 1 1 255 0 0 70000', 'outside of the range 0 to 255')
+        self.assertPPMError(b'P3 2 1 255 0 0 0', 'contains 3 color values, but its header describes 6')
+        self.assertPPMError(b'P6 1 1 255\n' + bytes([1, 2]), 'contains 2 bytes of pixel data, but its header describes 3')
+        self.assertPPMError(b'P6 1 1 100\n' + bytes([1, 200, 3]), 'outside of the range 0 to 100')
+
+if __name__ == '__main__':
+    unittest.main()
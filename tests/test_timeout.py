@@ -0,0 +1,42 @@
+# Tests for the multiprocessing timeouts in `source/tests/timeout.py`
+# Checks that a test run with `use_signals=False` sees the state left by the tests before it
+#
+# Usage (from the repository root):
+#   python3 -m unittest discover tests
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_output_comparison', 'source', 'tests'))
+# timeout.py
+import timeout
+
+# Module-level state, like `builtExecutables` in utils.py, changed between calls
+builtExecutables = []
+
+# Gets the state seen by the process the call runs in
+def readState():
+    return list(builtExecutables)
+
+class TestTimeoutState(unittest.TestCase):
+    def setUp(self):
+        builtExecutables.clear()
+
+    # A forked test sees the state left by the tests before it, even after an earlier call has run
+    def test_ForkSeesPreviousState(self):
+        read = timeout.timeout(5, use_signals=False)(readState)
+        self.assertEqual(read(), [])
+        builtExecutables.append('main.out')
+        self.assertEqual(read(), ['main.out'])
+
+    # A test that times out raises the timeout exception with its message
+    def test_TimeoutRaises(self):
+        def loop():
+            while True:
+                pass
+        with self.assertRaises(timeout.TimeoutError) as context:
+            timeout.timeout(0.5, use_signals=False, exception_message='timed out')(loop)()
+        self.assertEqual(str(context.exception), 'timed out')
+
+if __name__ == '__main__':
+    unittest.main()